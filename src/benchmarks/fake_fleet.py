@@ -0,0 +1,300 @@
+'''
+Fleet of fake ARK servers for load testing the update path without real game servers
+Answers A2S_INFO, A2S_RULES and A2S_PLAYER (with challenges and split packets)
+on many loopback ips and ports from one process
+
+Run from src directory:
+python benchmarks/fake_fleet.py --servers 1000 --latency 50 --jitter 20 --loss 0.01 --offline 0.2
+serves the fleet until stopped
+python benchmarks/fake_fleet.py --servers 50000 --bench --cycles 3
+also updates the fleet like the updater does (settings from config.py) and prints throughput, latency and packets
+
+Large fleets need a lot of sockets: ulimit -n 60000
+Ips other than 127.0.0.1 are loopback only on Linux (on macOS add them with ifconfig lo0 alias)
+'''
+import argparse
+import asyncio
+import json
+import os
+import random
+import struct
+import sys
+import time
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import query
+
+MAPS = ['TheIsland', 'TheCenter', 'ScorchedEarth_P', 'Ragnarok', 'Aberration_P',
+        'Extinction', 'Valguero_P', 'Genesis', 'CrystalIsles', 'Gen2']
+NAMES = ['Dino', 'Rex', 'Survivor', 'Tamer', 'Raider', 'Bob', 'Griefer', 'Builder', 'Human', '123']
+# max size of one packet before response is split
+PACKET_SIZE = 1248
+
+
+def string(value):
+    return value.encode('utf-8') + b'\x00'
+
+
+class FakeServer(asyncio.DatagramProtocol):
+    """One fake ARK server listening on it's own port"""
+    def __init__(self, fleet, number, rng):
+        self.fleet = fleet
+        self.transport = None
+        self.challenge = rng.randint(1, 2 ** 31 - 1)
+        self.offline = rng.random() < fleet.offline
+        version = f'v{rng.randint(300, 360)}.{rng.randint(0, 40)}'
+        self.name = f'Fake ARK #{number} - ({version})'
+        self.map = rng.choice(MAPS)
+        self.maxPlayers = rng.choice([10, 20, 50, 70])
+        # most community servers are empty
+        playersCount = 0 if rng.random() < 0.6 else rng.randint(1, self.maxPlayers)
+        self.players = [(f'{rng.choice(NAMES)}{rng.randint(0, 999)}', rng.uniform(0, 36000))
+                        for i in range(playersCount)]
+        self.started = time.monotonic()
+        self.rules = self.makeRules(rng)
+        self.splitId = number
+
+    def makeRules(self, rng):
+        rules = [('ALLOWDOWNLOADCHARS_i', '1'), ('ALLOWDOWNLOADITEMS_i', '1'),
+                 ('CUSTOMSERVERNAME_s', self.name.lower()), ('DayTime_s', f'{rng.randint(0, 2359):04}'),
+                 ('GameMode_s', 'TestGameMode_C'), ('HASACTIVEMODS_i', '1'), ('LEGACY_i', '0'),
+                 ('MATCHTIMEOUT_f', '120.000000'), ('Networking_i', '0'), ('OFFICIALSERVER_i', '0'),
+                 ('OWNINGID', '90142621000421377'), ('P2PPORT', '7777'), ('SEARCHKEYWORDS_s', 'Custom'),
+                 ('ServerPassword_b', 'false'), ('SERVERUSESBATTLEYE_b', 'true'), ('SESSIONFLAGS', '683'),
+                 ('SESSIONISPVE_i', str(rng.randint(0, 1)))]
+        if (rng.random() < 0.3):
+            rules.append(('ClusterId_s', f'cluster{rng.randint(0, 50)}'))
+        for i in range(rng.choice([0, 0, 3, 10, 25])):
+            rules.append((f'MOD{i}_s', f'{rng.randint(500000000, 2500000000)}:{rng.getrandbits(128):032X}'))
+        return rules
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data, addr):
+        if (self.offline or len(data) < 5):
+            return
+        fleet = self.fleet
+        # lost request
+        if (fleet.rng.random() < fleet.loss):
+            return
+        packets = self.respond(data)
+        delay = max(0.0, fleet.rng.gauss(fleet.latency, fleet.jitter)) / 1000
+        for packet in packets:
+            # lost reply
+            if (fleet.rng.random() < fleet.loss):
+                continue
+            asyncio.get_running_loop().call_later(delay, self.send, packet, addr)
+
+    def send(self, packet, addr):
+        if (not self.transport.is_closing()):
+            self.transport.sendto(packet, addr)
+
+    def respond(self, data):
+        '''Returns list of packets to send back'''
+        requestType = data[4]
+        if (requestType == query.A2S_INFO_REQUEST):
+            # like real servers ask for a challenge if request has none
+            if (len(data) < 29 or struct.unpack_from('<l', data, 25)[0] != self.challenge):
+                return [self.challengePacket()]
+            return self.split(self.info())
+        if (requestType in (query.A2S_RULES_REQUEST, query.A2S_PLAYER_REQUEST)):
+            if (len(data) < 9 or struct.unpack_from('<l', data, 5)[0] != self.challenge):
+                return [self.challengePacket()]
+            if (requestType == query.A2S_RULES_REQUEST):
+                return self.split(self.rulesPayload())
+            return self.split(self.playersPayload())
+        return []
+
+    def challengePacket(self):
+        return struct.pack('<lBl', query.SIMPLE_HEADER, query.A2S_CHALLENGE_RESPONSE, self.challenge)
+
+    def info(self):
+        port = self.transport.get_extra_info('sockname')[1]
+        return (bytes([query.A2S_INFO_RESPONSE, 17]) + string(self.name) + string(self.map) +
+                string('ark_survival_evolved') + string('ARK: Survival Evolved') +
+                struct.pack('<HBBBcc??', 0, len(self.players), self.maxPlayers, 0, b'd', b'l', False, True) +
+                string('1.0.0.0') + struct.pack('<BHQQ', 0x80 | 0x10 | 0x01, port, 90142621000421377, 346110))
+
+    def rulesPayload(self):
+        return (bytes([query.A2S_RULES_RESPONSE]) + struct.pack('<h', len(self.rules)) +
+                b''.join(string(name) + string(value) for name, value in self.rules))
+
+    def playersPayload(self):
+        played = time.monotonic() - self.started
+        return (bytes([query.A2S_PLAYER_RESPONSE, len(self.players)]) +
+                b''.join(b'\x00' + string(name) + struct.pack('<lf', 0, duration + played)
+                         for name, duration in self.players))
+
+    def split(self, payload):
+        '''Makes packets out of payload (splits it if it doesn't fit into one)'''
+        payload = struct.pack('<l', query.SIMPLE_HEADER) + payload
+        if (len(payload) <= PACKET_SIZE):
+            return [payload]
+        chunks = [payload[i:i + PACKET_SIZE] for i in range(0, len(payload), PACKET_SIZE)]
+        return [struct.pack('<llBBh', query.MULTI_HEADER, self.splitId, len(chunks), number, PACKET_SIZE) + chunk
+                for number, chunk in enumerate(chunks)]
+
+
+class Fleet():
+    """
+    Many fake servers in one process
+    Servers are spread over loopback ips (portsPerHost ports on each, like hosts of official clusters)
+    so big fleets don't run out of ports and per ip limits work like with real servers
+    """
+    def __init__(self, count, basePort, portsPerHost, latency, jitter, loss, offline, seed):
+        self.count = count
+        self.basePort = basePort
+        self.portsPerHost = portsPerHost
+        self.latency = latency # ms
+        self.jitter = jitter # ms
+        self.loss = loss # chance to lose a packet
+        self.offline = offline # part of servers that never answer
+        self.rng = random.Random(seed)
+        self.servers = []
+
+    def address(self, number):
+        '''(host, port) of a server (127.1.0.1, 127.1.0.2, ... are all loopback on Linux)'''
+        host = number // self.portsPerHost
+        return f'127.1.{host // 250}.{host % 250 + 1}', self.basePort + number % self.portsPerHost
+
+    async def start(self):
+        loop = asyncio.get_running_loop()
+        for number in range(self.count):
+            transport, server = await loop.create_datagram_endpoint(
+                lambda: FakeServer(self, number, self.rng), local_addr=self.address(number))
+            self.servers.append(server)
+
+    def close(self):
+        for server in self.servers:
+            server.transport.close()
+
+    def ips(self):
+        return ['{}:{}'.format(*self.address(i)) for i in range(self.count)]
+
+    def records(self):
+        '''
+        Records of the fleet like `servers` table has them (nothing cached yet)
+        Servers that never answer are already known as offline so they don't look like timeouts to the controller
+        '''
+        import classes as c # needs bot dependencies installed
+        return [(id, ip, int(ip.split(':')[1]), None, c.ARKServer(ip).toJSON(), c.PlayersList(ip).toJSON(),
+                 0 if server.offline else 1, 1 if server.offline else 0, '{}', None, None, None, None)
+                for id, (ip, server) in enumerate(zip(self.ips(), self.servers), 1)]
+
+
+def percentile(values, part):
+    if (len(values) == 0):
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * part))]
+
+
+async def bench(fleet, cycles):
+    '''
+    Updates the fleet the way NeoUpdater does (with ServerUpdater, ConcurrencyController, UpdateScheduler and ChangeTracker
+    from config.py settings) but keeps servers in memory instead of DB
+    Time between cycles is simulated: every cycle updates servers that are due in the next updateFrequency seconds
+    (servers that don't answer are skipped more and more like in production)
+    '''
+    import config
+    import registry
+    import updater
+    cfg = config.Config()
+    query.configure(cfg.packetsPerSecond, cfg.packetsBurst, cfg.perIpPacketsPerSecond, cfg.perIpPacketsBurst)
+    serverUpdater = updater.ServerUpdater(cfg)
+    controller = updater.ConcurrencyController(cfg.workersCount, cfg.minWorkersCount, cfg.maxWorkersCount,
+                                               cfg.maxLoopLag, cfg.maxTimeoutRate)
+    scheduler = updater.UpdateScheduler(cfg.updateFrequency, cfg.updateFrequency,
+                                        cfg.maxOfflineInterval, cfg.offlineIntervalJitter)
+    changes = updater.ChangeTracker(cfg.pingChangeThreshold, cfg.playersTimeThreshold)
+    servers = registry.ServerRegistry()
+    for record in fleet.records():
+        servers.put(record)
+    clock = time.monotonic() # simulated time
+    scheduler.sync(servers.ids(), clock)
+
+    def save(result):
+        '''Same as NeoUpdater.save without DB (encodes only what changed)'''
+        info = json.dumps(result.moreInfo)
+        if (not result.successful()):
+            servers.store(result.Id, 0, result.serverRecord[7] + 1, result.serverRecord[4], result.serverRecord[5], info)
+            return
+        serverHash = changes.serverChanged(result.Id, result.serverObj)
+        playersHash = changes.playersChanged(result.Id, result.playersObj, clock)
+        serverJSON = result.serverObj.toJSON() if serverHash != None else result.serverRecord[4]
+        playersJSON = result.playersObj.toJSON() if playersHash != None else result.serverRecord[5]
+        changes.wrote(result.Id, serverHash, result.serverObj.ping, playersHash, clock)
+        servers.store(result.Id, 1, 0, serverJSON, playersJSON, info)
+
+    for cycle in range(cycles):
+        due = scheduler.popDue(clock)
+        latencies = []
+        failed = 0
+        pending = asyncio.Queue()
+        for dueTime, id in due:
+            pending.put_nowait(servers.get(id))
+
+        async def worker():
+            nonlocal failed
+            while (not pending.empty()):
+                serverRecord = pending.get_nowait()
+                await controller.acquire()
+                try:
+                    start = time.perf_counter()
+                    result = await serverUpdater.updateServer(serverRecord)
+                    latencies.append(time.perf_counter() - start)
+                finally:
+                    await controller.release()
+                controller.record(result)
+                offlineTrys = 0 if result.successful() else serverRecord[7] + 1
+                scheduler.reschedule(result.Id, offlineTrys, clock)
+                if (not result.successful()):
+                    failed += 1
+                save(result)
+
+        controller.start()
+        changes.start()
+        lagMonitor = asyncio.create_task(controller.monitorLag())
+        start = time.perf_counter()
+        await asyncio.gather(*[worker() for i in range(controller.maximum)])
+        took = time.perf_counter() - start
+        lagMonitor.cancel()
+        packets = query.getTransport().scheduler.popStats()
+        print(f'cycle {cycle + 1}: {len(due)} of {fleet.count} servers due, updated in {took:.2f} s '
+              f'({len(due) / took:.0f} servers/s), {failed} failed, concurrency {controller.level}')
+        print(f'  {packets["packets"]} packets sent ({packets["delayed"]} delayed by rate limits), '
+              f'{changes.written} objects encoded ({changes.skipped} unchanged)')
+        print(f'  latency p50 {percentile(latencies, 0.5) * 1000:.1f} ms, '
+              f'p90 {percentile(latencies, 0.9) * 1000:.1f} ms, p99 {percentile(latencies, 0.99) * 1000:.1f} ms')
+        clock += cfg.updateFrequency
+
+
+async def main(args):
+    fleet = Fleet(args.servers, args.base_port, args.ports_per_host, args.latency, args.jitter,
+                  args.loss, args.offline, args.seed)
+    await fleet.start()
+    ips = fleet.ips()
+    print(f'Started {args.servers} fake servers ({ips[0]} - {ips[-1]})')
+    try:
+        if (args.bench):
+            await bench(fleet, args.cycles)
+        else:
+            while True:
+                await asyncio.sleep(3600)
+    finally:
+        fleet.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Fleet of fake ARK servers')
+    parser.add_argument('--servers', type=int, default=1000, help='how many servers to start')
+    parser.add_argument('--base-port', type=int, default=10000, help='port of the first server on every ip')
+    parser.add_argument('--ports-per-host', type=int, default=100, help='servers on one loopback ip')
+    parser.add_argument('--latency', type=float, default=50, help='mean reply delay in ms')
+    parser.add_argument('--jitter', type=float, default=10, help='standard deviation of reply delay in ms')
+    parser.add_argument('--loss', type=float, default=0.0, help='chance to lose a packet (0-1)')
+    parser.add_argument('--offline', type=float, default=0.2, help='part of servers that never answer (0-1)')
+    parser.add_argument('--seed', type=int, default=1, help='seed for repeatable fleets')
+    parser.add_argument('--bench', action='store_true', help='query the fleet and print results')
+    parser.add_argument('--cycles', type=int, default=3, help='how many update intervals to simulate in bench mode')
+    asyncio.run(main(parser.parse_args()))
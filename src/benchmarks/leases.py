@@ -0,0 +1,147 @@
+'''
+Simulation of server leases between several updaters (updaterLeases in config)
+Runs lease code of NeoUpdater (heartbeat, renewLeases, fairShare, claimLeases, releaseLeases)
+against in memory `servers` and `updaters` tables and prints how many servers every updater owns
+Shows that a new updater gets it's fair share from one that owns everything and
+that servers of a stopped updater are taken by the others
+
+Run from src directory: python benchmarks/leases.py [servers] [leaseBatchSize]
+'''
+import asyncio
+import os
+import sys
+import types
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import updater
+
+
+class FakeDB():
+    '''servers (Id -> [LeaseOwner, LeaseExpires]) and updaters (Instance -> LastSeen) with simulated NOW()'''
+    def __init__(self, count):
+        self.now = 0.0
+        self.servers = {id: [None, None] for id in range(1, count + 1)}
+        self.updaters = {}
+
+    def free(self, id):
+        expires = self.servers[id][1]
+        return expires == None or expires < self.now
+
+    async def execute(self, sql, params=()):
+        '''Runs one of statements lease code makes'''
+        if (sql.startswith('INSERT INTO updaters')):
+            self.updaters[params[0]] = self.now
+        elif (sql.startswith('DELETE FROM updaters WHERE LastSeen')):
+            self.updaters = {name: seen for name, seen in self.updaters.items() if seen >= self.now - params[0]}
+        elif (sql.startswith('DELETE FROM updaters WHERE Instance')):
+            self.updaters.pop(params[0], None)
+        elif (sql.startswith('UPDATE servers SET LeaseExpires')):
+            for lease in self.servers.values():
+                if (lease[0] == params[1]):
+                    lease[1] = self.now + params[0]
+        elif (sql.startswith('SELECT Id FROM servers WHERE LeaseOwner')):
+            return [(id,) for id, lease in sorted(self.servers.items()) if lease[0] == params[0]]
+        elif (sql.startswith('SELECT COUNT(*) FROM servers')):
+            return [(self.servers.__len__(),)]
+        elif (sql.startswith('SELECT COUNT(*) FROM updaters')):
+            return [(self.updaters.__len__(),)]
+        elif (sql.startswith('UPDATE servers SET LeaseOwner=NULL')):
+            ids = params[1:] if 'Id IN' in sql else list(self.servers)
+            for id in ids:
+                if (self.servers[id][0] == params[0]):
+                    self.servers[id] = [None, None]
+        elif (sql.startswith('SELECT Id FROM servers WHERE LeaseExpires IS NULL')):
+            return [(id,) for id in sorted(self.servers) if self.free(id)][:params[0]]
+        elif (sql.startswith('UPDATE servers SET LeaseOwner=%s')):
+            for id in params[2:]:
+                self.servers[id] = [params[0], self.now + params[1]]
+        else:
+            raise ValueError(f'Unknown statement: {sql}')
+        return []
+
+
+class FakeConnection():
+    '''What claimLeases uses of aiomysql connection'''
+    def __init__(self, db):
+        self.db = db
+        self.result = []
+
+    def cursor(self):
+        return self
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        pass
+
+    async def execute(self, sql, params=()):
+        self.result = await self.db.execute(sql, params)
+
+    async def fetchall(self):
+        return self.result
+
+    async def begin(self):
+        pass
+
+    async def commit(self):
+        pass
+
+    async def rollback(self):
+        pass
+
+
+class FakePool():
+    def __init__(self, db):
+        self.db = db
+
+    async def acquire(self):
+        return FakeConnection(self.db)
+
+    def release(self, conn):
+        pass
+
+
+def makeUpdater(db, instance, leaseBatchSize):
+    '''Object with lease methods of NeoUpdater (without discord and the rest of the cog)'''
+    self = types.SimpleNamespace(instance=instance, leased=set(), sqlPool=FakePool(db),
+                                 cfg=types.SimpleNamespace(leaseTime=120, leaseBatchSize=leaseBatchSize, maxLeasedServers=0))
+    self.makeAsyncRequest = db.execute
+    for name in ('heartbeat', 'renewLeases', 'fairShare', 'releaseLeases', 'claimLeases'):
+        setattr(self, name, types.MethodType(getattr(updater.NeoUpdater, name), self))
+    return self
+
+
+async def loops(db, updaters, count, interval=30):
+    '''Runs count loops of every updater (interval seconds apart)'''
+    for i in range(count):
+        for one in updaters:
+            await one.renewLeases()
+        db.now += interval
+        print('  ' + ', '.join(f'{one.instance}: {one.leased.__len__()}' for one in updaters))
+
+
+async def main():
+    servers = int(sys.argv[1]) if sys.argv.__len__() > 1 else 10000
+    leaseBatchSize = int(sys.argv[2]) if sys.argv.__len__() > 2 else 500
+    db = FakeDB(servers)
+    a = makeUpdater(db, 'A', leaseBatchSize)
+    b = makeUpdater(db, 'B', leaseBatchSize)
+    c = makeUpdater(db, 'C', leaseBatchSize)
+    print(f'A alone ({servers} servers, {leaseBatchSize} claimed per loop at most):')
+    await loops(db, [a], servers // leaseBatchSize + 1)
+    print('B starts:')
+    await loops(db, [a, b], servers // leaseBatchSize + 2)
+    print('C starts:')
+    await loops(db, [a, b, c], servers // leaseBatchSize + 2)
+    print('B stops (and gives it\'s servers back):')
+    await db.execute('DELETE FROM updaters WHERE Instance=%s', (b.instance,))
+    await db.execute('UPDATE servers SET LeaseOwner=NULL, LeaseExpires=NULL, ExternalChange=ExternalChange WHERE LeaseOwner=%s', (b.instance,))
+    await loops(db, [a, c], servers // leaseBatchSize + 2)
+    print('C dies (leases expire):')
+    await loops(db, [a], servers // leaseBatchSize + 6)
+    owners = [lease[0] for lease in db.servers.values()]
+    print('Final owners: ' + ', '.join(f'{name}: {owners.count(name)}' for name in sorted(set(owners), key=str)))
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
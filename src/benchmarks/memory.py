@@ -0,0 +1,72 @@
+'''
+Memory footprint of servers held in memory
+Compares old dict based ARKServer/PlayersList/Player (escaped names and formatted times in every Player)
+with current slotted classes (player names and durations in two arrays)
+
+Run from src directory: python benchmarks/memory.py [servers] [players per server]
+'''
+import os
+import sys
+import tracemalloc
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import classes as c
+from serialization import OldObject
+
+
+def makeServer(i):
+    '''Makes i-th ARKServer (every server has it's own strings like after decoding from DB)'''
+    server = c.ARKServer(f'10.{i // 65536 % 256}.{i // 256 % 256}.{i % 256}:27015')
+    server.name = f'Some Cool PVE Server #{i} - (v345.1)'
+    server.version = 'v345.1'
+    server.stripedName = f'Some Cool PVE Server #{i}'
+    server.serverSteamId = 90142621000421377 + i
+    server.platform = 'Linux'
+    server.online = 10
+    server.maxPlayers = 70
+    server.map = 'TheIsland'
+    server.password = False
+    server.isARK = True
+    server.game_id = 346110
+    server.ping = 42
+    server.PVE = True
+    server.clusterName = f'Cluster{i // 10}'
+    server.mods = [str(2263656440 + i + j) for j in range(5)]
+    return server
+
+
+def makePlayers(i, count):
+    players = c.PlayersList(f'10.{i // 65536 % 256}.{i // 256 % 256}.{i % 256}:27015')
+    players.list = [c.Player(f'Player {i}-{j}', j * 137.5 + i) for j in range(count)]
+    return players
+
+
+def makeOld(server, players):
+    '''Makes old style objects with the same data'''
+    oldServer = OldObject(address=server.address, port=server.port, **server.encode())
+    oldPlayers = OldObject(ip=players.ip, address=players.address, port=players.port,
+                           list=[OldObject(time=player.time, name=player.name) for player in players.list])
+    return oldServer, oldPlayers
+
+
+def measure(make):
+    '''Returns bytes allocated by objects make() returns'''
+    tracemalloc.start()
+    objects = make()
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del objects
+    return size
+
+
+def main():
+    servers = int(sys.argv[1]) if sys.argv.__len__() > 1 else 50000
+    playersCount = int(sys.argv[2]) if sys.argv.__len__() > 2 else 10
+    new = measure(lambda: [(makeServer(i), makePlayers(i, playersCount)) for i in range(servers)])
+    old = measure(lambda: [makeOld(makeServer(i), makePlayers(i, playersCount)) for i in range(servers)])
+    print(f'{servers} servers with {playersCount} players each:')
+    print(f'  old: {old / 2**20:8.1f} MiB ({old / servers:6.0f} bytes per server)')
+    print(f'  new: {new / 2**20:8.1f} MiB ({new / servers:6.0f} bytes per server), x{old / new:.2f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,93 @@
+'''
+Micro-benchmark of A2S_RULES decoding
+Compares old path (python-a2s decodes every rule into dict and values are picked out of it)
+with query.parseARKRules that decodes only what ARKServer needs
+
+Run from src directory: python benchmarks/rules_parser.py
+'''
+import io
+import os
+import struct
+import sys
+import timeit
+from a2s.defaults import DEFAULT_ENCODING
+from a2s.byteio import ByteReader
+from a2s.rules import RulesProtocol
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import query
+
+
+def makePayload(modsCount=10):
+    '''Makes rules response that looks like one from an ARK server'''
+    rules = {
+        'ALLOWDOWNLOADCHARS_i': '1',
+        'ALLOWDOWNLOADITEMS_i': '1',
+        'ClusterId_s': 'SomeCluster',
+        'CUSTOMSERVERNAME_s': 'some server name',
+        'DayTime_s': '1234',
+        'GameMode_s': 'TestGameMode_C',
+        'HASACTIVEMODS_i': '1',
+        'LEGACY_i': '0',
+        'MATCHTIMEOUT_f': '120.000000',
+        'ModId_l': '0',
+        'Networking_i': '0',
+        'NUMOPENPUBCONN': '50',
+        'OFFICIALSERVER_i': '0',
+        'OWNINGID': '90142621000421377',
+        'OWNINGNAME': '90142621000421377',
+        'P2PADDR': '90142621000421377',
+        'P2PPORT': '7777',
+        'SEARCHKEYWORDS_s': 'Custom',
+        'ServerPassword_b': 'false',
+        'SERVERUSESBATTLEYE_b': 'true',
+        'SESSIONFLAGS': '683',
+        'SESSIONISPVE_i': '1',
+    }
+    for i in range(modsCount):
+        rules[f'MOD{i}_s'] = f'{2263656440 + i}:B21AEF7F4B2485EFA15394881AFB84BC'
+    body = b''.join(name.encode() + b'\x00' + value.encode() + b'\x00' for name, value in rules.items())
+    return bytes([query.A2S_RULES_RESPONSE]) + struct.pack('<h', len(rules)) + body
+
+
+def oldPath(payload):
+    '''What AGetInfo used to do with a2s.arules result (decoded the same way a2s.arules decodes it)'''
+    reader = ByteReader(io.BytesIO(payload), endian='<', encoding=DEFAULT_ENCODING)
+    responseType = reader.read_uint8()
+    data = RulesProtocol.deserialize_response(reader, responseType, 0)
+    pve = bool(int(data['SESSIONISPVE_i']))
+    try:
+        clusterName = data['ClusterId_s']
+    except KeyError:
+        clusterName = None
+    mods = []
+    if ('MOD0_s' in data):
+        mods.append(data['MOD0_s'].split(':')[0])
+        end = True
+        i = 1
+        while (end):
+            if (f'MOD{i}_s' in data):
+                mods.append(data[f'MOD{i}_s'].split(':')[0])
+                i += 1
+            else:
+                end = False
+    return pve, clusterName, mods
+
+
+def newPath(payload):
+    rules = query.parseARKRules(payload)
+    return rules.pve, rules.clusterName, rules.mods
+
+
+def main():
+    number = 2000
+    for modsCount in (0, 10, 40):
+        payload = makePayload(modsCount)
+        # both paths must agree
+        assert oldPath(payload) == newPath(payload)
+        old = min(timeit.repeat(lambda: oldPath(payload), number=number, repeat=5)) / number
+        new = min(timeit.repeat(lambda: newPath(payload), number=number, repeat=5)) / number
+        print(f'{modsCount:>3} mods, {len(payload):>5} bytes: old {old * 1e6:7.2f} us, new {new * 1e6:7.2f} us, x{old / new:.2f}')
+
+
+if __name__ == '__main__':
+    main()
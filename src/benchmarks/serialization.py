@@ -0,0 +1,81 @@
+'''
+Benchmark of ServerObj/PlayersObj serialization
+Compares jsonpickle on the old dict based classes (what JSON.toJSON used before FORMAT_VERSION 1)
+with the current format: encode and decode speed and bytes stored per row
+
+Run from src directory: python benchmarks/serialization.py
+'''
+import os
+import sys
+import timeit
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import jsonpickle
+import classes as c
+
+
+class OldObject():
+    '''Stand-in for old ARKServer, PlayersList and Player (plain objects with a dict of fields)'''
+    def __init__(self, **fields):
+        self.__dict__.update(fields)
+
+
+def makeServer():
+    '''Makes ARKServer that looks like one after an update'''
+    server = c.ARKServer('192.168.1.100:27015')
+    server.name = 'Some Cool PVE Server - (v345.1)'
+    server.version = 'v345.1'
+    server.stripedName = 'Some Cool PVE Server'
+    server.serverSteamId = 90142621000421377
+    server.platform = 'PC'
+    server.online = 35
+    server.maxPlayers = 70
+    server.map = 'TheIsland'
+    server.password = False
+    server.isARK = True
+    server.game_id = 346110
+    server.ping = 42
+    server.PVE = True
+    server.clusterName = 'SomeCluster'
+    server.mods = [str(2263656440 + i) for i in range(10)]
+    return server
+
+
+def makePlayers(count):
+    '''Makes PlayersList with count players'''
+    players = c.PlayersList('192.168.1.100:27015')
+    players.list = [c.Player(f'Player number {i}', i * 137.5) for i in range(count)]
+    return players
+
+
+def makeOld(obj):
+    '''Makes old style object with the same data'''
+    if (isinstance(obj, c.PlayersList)):
+        return OldObject(ip=obj.ip, address=obj.address, port=obj.port,
+                         list=[OldObject(time=player.time, name=player.name) for player in obj.list])
+    return OldObject(address=obj.address, port=obj.port, **obj.encode())
+
+
+def measure(name, obj, number):
+    oldObj = makeOld(obj)
+    old = jsonpickle.encode(oldObj)
+    new = obj.toJSON()
+    assert c.JSON.fromJSON(new).encode() == obj.encode()
+    oldEncode = min(timeit.repeat(lambda: jsonpickle.encode(oldObj), number=number, repeat=5)) / number
+    newEncode = min(timeit.repeat(lambda: obj.toJSON(), number=number, repeat=5)) / number
+    oldDecode = min(timeit.repeat(lambda: jsonpickle.decode(old), number=number, repeat=5)) / number
+    newDecode = min(timeit.repeat(lambda: c.JSON.fromJSON(new), number=number, repeat=5)) / number
+    print(f'{name}:')
+    print(f'  encode: jsonpickle {1 / oldEncode:9.0f}/s, new {1 / newEncode:9.0f}/s, x{oldEncode / newEncode:.2f}')
+    print(f'  decode: jsonpickle {1 / oldDecode:9.0f}/s, new {1 / newDecode:9.0f}/s, x{oldDecode / newDecode:.2f}')
+    print(f'  bytes:  jsonpickle {len(old.encode()):9}, new {len(new.encode()):9}, x{len(old) / len(new):.2f}')
+
+
+def main():
+    number = 2000
+    measure('ARKServer', makeServer(), number)
+    for count in (0, 10, 70):
+        measure(f'PlayersList ({count} players)', makePlayers(count), number)
+
+
+if __name__ == '__main__':
+    main()
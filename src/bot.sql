@@ -122,7 +122,10 @@ CREATE TABLE `servers` (
   `LastOnline` int NOT NULL DEFAULT '1' COMMENT '0 or 1 indicating if the server was online or not last time we checked it.',
   `OfflineTrys` int NOT NULL DEFAULT '0' COMMENT 'Counts how many attempts were made to reach server.',
   `Info` text CHARACTER SET utf8 COLLATE utf8_general_ci NOT NULL DEFAULT (_utf8mb4'{}') COMMENT 'Additional JSON info about server',
-  `LastUpdated` timestamp NOT NULL DEFAULT CURRENT_TIMESTAMP COMMENT 'Timestamp that updates every time the record is updated'
+  `LastUpdated` timestamp NOT NULL DEFAULT CURRENT_TIMESTAMP COMMENT 'Timestamp that updates every time the record is updated',
+  `ExternalChange` timestamp(6) NOT NULL DEFAULT CURRENT_TIMESTAMP(6) ON UPDATE CURRENT_TIMESTAMP(6) COMMENT 'Time of the last change not made by the updater (updater never bumps it). See: /src/updater.py syncServers',
+  `LeaseOwner` varchar(100) DEFAULT NULL COMMENT 'Updater instance that updates this server (if updaterLeases is on)',
+  `LeaseExpires` datetime DEFAULT NULL COMMENT 'Other updater can take the server after this time'
 ) ENGINE=InnoDB DEFAULT CHARSET=utf8;
 
 -- --------------------------------------------------------
@@ -138,7 +141,19 @@ CREATE TABLE `settings` (
   `ServersId` text CHARACTER SET utf8 COLLATE utf8_general_ci,
   `Admins` text CHARACTER SET utf8 COLLATE utf8_general_ci,
   `Type` int NOT NULL,
-  `Aliases` text CHARACTER SET utf8 COLLATE utf8_general_ci
+  `Aliases` text CHARACTER SET utf8 COLLATE utf8_general_ci,
+  `LastChanged` timestamp(6) NOT NULL DEFAULT CURRENT_TIMESTAMP(6) ON UPDATE CURRENT_TIMESTAMP(6) COMMENT 'Time of the last change of the row. See: /src/updater.py syncGuilds'
+) ENGINE=InnoDB DEFAULT CHARSET=utf8;
+
+-- --------------------------------------------------------
+
+--
+-- Table structure for table `updaters`
+--
+
+CREATE TABLE `updaters` (
+  `Instance` varchar(100) NOT NULL COMMENT 'Name of updater instance (same as servers.LeaseOwner)',
+  `LastSeen` datetime NOT NULL COMMENT 'Last time updater was alive. See: /src/updater.py heartbeat'
 ) ENGINE=InnoDB DEFAULT CHARSET=utf8;
 
 -- --------------------------------------------------------
@@ -200,13 +215,24 @@ ALTER TABLE `officialServers`
 -- Indexes for table `servers`
 --
 ALTER TABLE `servers`
-  ADD PRIMARY KEY (`Id`);
+  ADD PRIMARY KEY (`Id`),
+  ADD KEY `ExternalChange` (`ExternalChange`),
+  ADD KEY `LeaseExpires` (`LeaseExpires`),
+  ADD KEY `LeaseOwner` (`LeaseOwner`);
 
 --
 -- Indexes for table `settings`
 --
 ALTER TABLE `settings`
-  ADD PRIMARY KEY (`Id`);
+  ADD PRIMARY KEY (`Id`),
+  ADD KEY `LastChanged` (`LastChanged`);
+
+--
+-- Indexes for table `updaters`
+--
+ALTER TABLE `updaters`
+  ADD PRIMARY KEY (`Instance`),
+  ADD KEY `LastSeen` (`LastSeen`);
 
 --
 -- Indexes for table `users`
@@ -1,9 +1,9 @@
 import asyncio
 import a2s
-import arrow
 import json
+import datetime
+from array import array
 from helpers import sendToMe
-import jsonpickle
 import requests
 import os
 from os import path
@@ -12,28 +12,114 @@ import concurrent.futures._base as base
 import socket
 import discord
 import time
+import query
 
 class ARKServerError(Exception): # ARK server error
     def __init__(self,reason, error, *args, **kwargs) :
         self.reason = reason
         self.error = error
         super().__init__(*args, **kwargs)
-    pass
+
+    # so it can be sent between processes (see shard.py)
+    def __reduce__(self):
+        return (type(self), (self.reason, self.error) + self.args)
+
+def queryError(e):
+    """
+    Converts an exception from the query layer into ARKServerError
+    Returns None if it isn't an error of the query
+    """
+    if (isinstance(e, base.TimeoutError)):
+        return ARKServerError('1: Timeout',e)
+    if (isinstance(e, socket.gaierror)):
+        return ARKServerError('2: DNS resolution error',e)
+    if (isinstance(e, ConnectionRefusedError)):
+        return ARKServerError('3: Connection was refused',e)
+    if (isinstance(e, query.BrokenMessageError)):
+        return ARKServerError('5: Broken message',e)
+    if (isinstance(e, OSError)): # https://github.com/Yepoleb/python-a2s/issues/23
+        return ARKServerError('4: OSError',e)
+    return None
+
+# version of the format JSON.toJSON writes (bump it if fields change and teach decode() to read old one)
+# 0 - jsonpickle, 1 - dicts with formatted player times, 2 - player names and durations in separate lists
+FORMAT_VERSION = 2
+
+def isOldFormat(JSONText):
+    """True if text was written in older format (jsonpickle or older FORMAT_VERSION) and should be rewritten"""
+    return JSONText != None and not JSONText.startswith(f'{{"v":{FORMAT_VERSION},')
+
+def parseDuration(text):
+    """Converts formatted time ('1 day, 2:03:04' or '2:03:04') back to seconds"""
+    days = 0
+    if (',' in text):
+        dayPart, text = text.split(',')
+        days = int(dayPart.split()[0])
+    hours, minutes, seconds = text.strip().split(':')
+    return float(days * 86400 + int(hours) * 3600 + int(minutes) * 60 + int(seconds))
 
 class JSON: #base class
-    """Base class for all classes to easly JSON encode and decode"""
+    """
+    Base class for all classes to easly JSON encode and decode
+    Objects are stored as plain dicts: {"v": format version, "t": class name, ...fields}
+    Subclasses can override encode()/decode() to store fields more compactly
+    Old jsonpickle text ({"py/object": ...}) can still be decoded (as version 0)
+    """
+    __slots__ = ()
+    types = {} # class name -> class (filled by __init_subclass__)
+
     def __init__(self):
         pass
 
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        JSON.types[cls.__name__] = cls
+
+    def encode(self):
+        """Returns dict of fields to store"""
+        return dict(self.__dict__)
+
+    @classmethod
+    def decode(cls, data, version):
+        """Makes object out of stored fields (without calling __init__)"""
+        self = cls.__new__(cls)
+        self.__dict__.update(data)
+        return self
+
     def toJSON(self):
-        return jsonpickle.encode(self) # yeah pickles I know
+        # version goes first so isOldFormat can check it without decoding
+        data = {'v': FORMAT_VERSION, 't': type(self).__name__}
+        data.update(self.encode())
+        return json.dumps(data, separators=(',', ':'))
 
     def fromJSON(JSONText):
-        self = jsonpickle.decode(JSONText) # decode and return
-        return self
+        # type is taken from the text so it doesn't matter on which class it is called
+        data = json.loads(JSONText)
+        if ('py/object' in data):
+            return decodeLegacy(data)
+        version = data.pop('v')
+        if (version > FORMAT_VERSION):
+            raise ValueError(f'Unknown format version {version} (newer bot wrote it ?)')
+        return JSON.types[data.pop('t')].decode(data, version)
+
+def decodeLegacy(data):
+    """Decodes dict made by jsonpickle ({"py/object": "classes.ARKServer", ...})"""
+    cls = JSON.types[data['py/object'].split('.')[-1]]
+    # newer jsonpickle puts fields into py/state
+    fields = data.get('py/state', data)
+    fields = {key: value for key, value in fields.items() if not key.startswith('py/')}
+    if ('list' in fields):
+        fields['list'] = [decodeLegacy(player) for player in fields['list']]
+    return cls.decode(fields, 0)
 
 class ARKServer(JSON):
     """Represents ARK server"""
+    # fields are in slots so thousands of servers in memory don't have a dict each
+    __slots__ = ('ip', 'address', 'port', 'name', 'version', 'stripedName', 'serverSteamId', 'platform',
+                 'online', 'maxPlayers', 'map', 'password', 'isARK', 'game_id', 'ping', 'PVE', 'clusterName', 'mods',
+                 # only in old objects (BattlemetricsPlugin moves it into Info)
+                 'battleURL')
+
     def __init__(self,ip):
         """Inititialisation of this class
         ip = ip:port
@@ -42,6 +128,21 @@ class ARKServer(JSON):
         self.address , self.port = ip.split(':') # split adress to ip and port
         self.port = int(self.port) # convert port to int
         pass
+
+    def encode(self):
+        # address and port are made from ip (fields that weren't set aren't stored)
+        data = {'ip': self.ip}
+        data.update({name: getattr(self, name) for name in ARKServer.__slots__[3:] if hasattr(self, name)})
+        return data
+
+    @classmethod
+    def decode(cls, data, version):
+        self = cls(data['ip'])
+        for name in ARKServer.__slots__[3:]:
+            # old objects can miss some fields (and have ones we don't use anymore)
+            if (name in data):
+                setattr(self, name, data[name])
+        return self
     
 
     async def AGetInfo(self):
@@ -55,18 +156,26 @@ class ARKServer(JSON):
         """
         try:
             #start = time.perf_counter()
-            server = await a2s.ainfo((self.address,self.port)) # get server data
-            data = await a2s.arules((self.address,self.port)) # custom ARK data
+            # get server data and custom ARK data at the same time
+            server, data = await asyncio.gather(query.info(self.address,self.port), query.rules(self.address,self.port))
             #end = time.perf_counter()
             #print(f'Raw async get time: {end - start:.4}')
-        except base.TimeoutError as e: 
-            raise ARKServerError('1: Timeout',e)
-        except socket.gaierror as e:
-            raise ARKServerError('2: DNS resolution error',e)
-        except ConnectionRefusedError as e:
-            raise ARKServerError('3: Connection was refused',e)
-        except OSError as e: # https://github.com/Yepoleb/python-a2s/issues/23
-            raise ARKServerError('4: OSError',e)
+        except BaseException as e:
+            error = queryError(e)
+            if (error == None): # not an error of the query
+                raise
+            raise error
+        self.loadInfo(server)
+        self.loadRules(data)
+        return self
+
+    def loadInfo(self, server):
+        """
+        Fills this class with A2S_INFO data
+
+        Parameters:
+        server - info returned by the query layer
+        """
         self.name = discord.utils.escape_mentions(server.server_name) # get raw name of the server
         version = server.server_name # get name
         first = version.find('(') # split out version
@@ -91,32 +200,6 @@ class ARKServer(JSON):
         self.maxPlayers = server.max_players # get max players server can accept
         self.map = discord.utils.escape_mentions(server.map_name) # get name of server's map
         self.password = server.password_protected # get if server is protected by password
-        try:
-            self.PVE = bool(int(data['SESSIONISPVE_i'])) # get if server is PVE
-        except KeyError as e:
-            raise ARKServerError('Not an ARK Server!',e) # it is not an ARK server !
-        try:
-            self.clusterName = discord.utils.escape_mentions(data['ClusterId_s']) # cluster name
-        except KeyError:
-            self.clusterName = None # it can be 
-        # list of mods installed on the server (but currently it is limited to only first 4 of them)
-        self.mods = [] # list of mods
-        # example :
-        # 'MOD0_s': '2263656440:B21AEF7F4B2485EFA15394881AFB84BC',
-        # 'MOD1_s': '1984129536:580AC4F84A4873E0A54447B0CCF11567', 
-        # 'MOD2_s': '2250262711:0FCA88A24D63B7B55CF9FBB48A0F1C4A', 
-        # 'MOD3_s': '2047318996:27A6E5F84484EE106FBD79A8B09D6794'
-        # (part after : is mystery to me )
-        if ('MOD0_s' in data): # if we have any mods on server
-            self.mods.append(data['MOD0_s'].split(':')[0]) # split the value 
-            end = True # it is reverse meaning 
-            i = 1 
-            while (end): # while not end
-    	        if (f'MOD{i}_s' in data): # if we have i-th mod in data
-    		        self.mods.append(data[f'MOD{i}_s'].split(':')[0]) # append it's id to the list
-    		        i += 1 # increase i
-    	        else:
-    		        end = False # else end the loop
         #protection against non-ARK servers
         self.isARK = False
         self.game_id = server.game_id # just for fun
@@ -145,7 +228,39 @@ class ARKServer(JSON):
         #HEADERS = {'User-Agent' : "Magic Browser"}
         #async with aiohttp.request("GET", 'http://arkdedicated.com/version', headers=HEADERS) as response:
         #    self.newestVersion = discord.utils.escape_mentions(await response.text()) # just in case ya know
-        return self
+
+    def loadRules(self, data):
+        """
+        Fills this class with custom ARK data (A2S_RULES)
+
+        Parameters:
+        data - query.ARKRules returned by the query layer
+        """
+        if (data.pve == None):
+            raise ARKServerError('Not an ARK Server!',KeyError('SESSIONISPVE_i')) # it is not an ARK server !
+        self.PVE = data.pve # get if server is PVE
+        if (data.clusterName != None):
+            self.clusterName = discord.utils.escape_mentions(data.clusterName) # cluster name
+        else:
+            self.clusterName = None # it can be 
+        # list of ids of mods installed on the server
+        # example :
+        # 'MOD0_s': '2263656440:B21AEF7F4B2485EFA15394881AFB84BC',
+        # 'MOD1_s': '1984129536:580AC4F84A4873E0A54447B0CCF11567', 
+        # (part after : is mystery to me )
+        self.mods = data.mods
+
+    def copyRules(self, server):
+        """
+        Copies data that comes from rules from another (cached) server object
+        Returns False if that object has no such data
+        """
+        if (not hasattr(server, 'PVE')):
+            return False
+        self.PVE = server.PVE
+        self.clusterName = getattr(server, 'clusterName', None)
+        self.mods = getattr(server, 'mods', [])
+        return True
 
     def GetInfo(self):
         """Function to get info about server
@@ -217,21 +332,43 @@ class ARKServer(JSON):
     
 class Player(JSON):
     """Internal Player class
-    time - arrow library object
-    name - string
+    rawName - name as server sent it
+    duration - seconds on the server (float)
+    name and time are made from them when they are displayed
     """
+    __slots__ = ('rawName', 'duration')
+
     def __init__(self,name,time):
-        basetime= arrow.get(0)
-        time = arrow.get(int(time)) #convert to int because of decimal digits later 
-        time = time - basetime
-        self.time = time.__str__()
-        self.name = discord.utils.escape_mentions(name)
-        pass  
+        self.rawName = name
+        self.duration = float(time)
+
+    @property
+    def name(self):
+        return discord.utils.escape_mentions(self.rawName)
+
+    @property
+    def time(self):
+        # int because of decimal digits ('1 day, 2:03:04' or '2:03:04')
+        return str(datetime.timedelta(seconds=int(self.duration)))
+
+    def encode(self):
+        return {'name': self.rawName, 'duration': self.duration}
+
+    @classmethod
+    def decode(cls, data, version):
+        if (version < 2):
+            # names were stored escaped
+            return cls(data['name'].replace('@\u200b', '@'), parseDuration(data['time']))
+        return cls(data['name'], data['duration'])
 
 class PlayersList(JSON):
     """Players list class
-    self.list - is a list of Player class instaces
+    self.names - list of player names (as server sent them)
+    self.durations - array of seconds each player is on the server
+    self.list - list of Player class instaces (made on each access)
     """
+    __slots__ = ('ip', 'address', 'port', 'names', 'durations')
+
     def __init__(self,ip):
         """Init of this class
         ip - ip:port
@@ -239,51 +376,134 @@ class PlayersList(JSON):
         self.ip = ip
         self.address , self.port = ip.split(':') # split adress to ip and port
         self.port = int(self.port) # convert port to int
-        self.list = []
+        self.names = []
+        self.durations = array('d')
         pass
 
+    @property
+    def list(self):
+        return [Player(name, duration) for name, duration in zip(self.names, self.durations)]
+
+    @list.setter
+    def list(self, players):
+        self.names = [player.rawName for player in players]
+        self.durations = array('d', [player.duration for player in players])
+
+    def encode(self):
+        # durations are rounded to save space (only whole seconds are displayed)
+        return {'ip': self.ip, 'names': self.names, 'durations': [round(duration, 1) for duration in self.durations]}
+
+    @classmethod
+    def decode(cls, data, version):
+        self = cls(data['ip'])
+        if (version == 0): # list of Player objects
+            self.list = data['list']
+        elif (version == 1): # list of [name, formatted time]
+            self.names = [name.replace('@\u200b', '@') for name, time in data['list']]
+            self.durations = array('d', [parseDuration(time) for name, time in data['list']])
+        else:
+            self.names = data['names']
+            self.durations = array('d', data['durations'])
+        return self
+
     async def AgetPlayersList(self):
         """Gets all needed data"""
         try :
-            players = await a2s.aplayers((self.address,self.port)) # get raw data
-        except base.TimeoutError as e:
-            raise ARKServerError('1: Timeout',e)
-        except socket.gaierror as e:
-            raise ARKServerError('2: DNS resolution error',e)
-        except ConnectionRefusedError as e:
-            raise ARKServerError('3: Connection was refused',e)
-        except OSError as e: # https://github.com/Yepoleb/python-a2s/issues/23
-            raise ARKServerError('4: OSError',e)
-        result = [] 
+            players = await query.players(self.address,self.port) # get raw data
+        except BaseException as e:
+            error = queryError(e)
+            if (error == None): # not an error of the query
+                raise
+            raise error
+        return self.loadPlayers(players)
+
+    def loadPlayers(self, players):
+        """Fills the list with A2S_PLAYER data returned by the query layer"""
+        names = []
+        durations = array('d')
         for player in players: # for each player in data
-            name = discord.utils.escape_mentions(player.name)
+            name = player.name
             if (name == ''):
                 #continue # remove all unknown players (to match steam server viewer) TODO: remove them from player count
                 name = '(unknown player)' # don't worth it and those are steam bugs not mine why I am requried to fix them ?
             try:
-                print(name,file=open(os.devnull,'w'))
+                name.encode() # names that can't be printed (e.g. broken surrogates)
             except BaseException:
                 name = '(invalid name)'
-            result.append(Player(name,player.duration)) # construct player class and append it to our results
-        self.list = result 
+            # names are escaped when they are displayed (see Player.name)
+            names.append(name)
+            durations.append(player.duration)
+        self.names = names
+        self.durations = durations
         return self
 
     def getPlayersList(self):
         """Gets all needed data"""
         players = a2s.players((self.address,self.port)) # get raw data
-        result = [] 
-        for player in players: # for each player in data
-            name = discord.utils.escape_mentions(player.name)
-            if (name == ''):
-                name = '(unknown player)'
+        return self.loadPlayers(players)
+
+
+class ServerQuery():
+    """
+    Queries info, rules and players of a server at once
+    self.server - ARKServer (filled only with data that answered)
+    self.players - PlayersList (empty if players didn't answer)
+    self.errors - dict kind -> ARKServerError for every request that failed
+    """
+    def __init__(self,ip):
+        """Init of this class
+        ip - ip:port
+        """
+        self.ip = ip
+        self.server = ARKServer(ip)
+        self.players = PlayersList(ip)
+        self.answered = set() # kinds of requests that got an answer
+        self.errors = {}
+        self.info = None # raw info response (has ping in seconds)
+        pass
+
+    async def AQuery(self, timeouts=None, kinds=query.KINDS):
+        """
+        Sends all requests concurrently
+        timeouts - dict kind -> seconds (every request has it's own deadline)
+        Returns self
+        """
+        results = await query.queryAll(self.server.address, self.server.port, timeouts, kinds)
+        for kind, result in results.items():
+            if (isinstance(result, BaseException)):
+                error = queryError(result)
+                if (error == None): # not an error of the query
+                    raise result
+                self.errors[kind] = error
+                continue
             try:
-                print(name,file=open(os.devnull,'w'))
-            except BaseException:
-                name = '(invalid name)'
-            result.append(Player(name,player.duration)) # construct player class and append it to our results
-        self.list = result 
+                if (kind == query.INFO):
+                    self.info = result
+                    self.server.loadInfo(result)
+                elif (kind == query.RULES):
+                    self.server.loadRules(result)
+                else:
+                    self.players.loadPlayers(result)
+            except ARKServerError as e: # e.g. rules of non-ARK server
+                self.errors[kind] = e
+                continue
+            self.answered.add(kind)
         return self
 
+    def online(self):
+        """Server is online if it answered info request"""
+        return query.INFO in self.answered
+
+    def error(self):
+        """
+        Returns ARKServerError describing what failed (None if nothing failed)
+        """
+        if (self.errors.__len__() == 0):
+            return None
+        # server is down if info failed
+        if (query.INFO in self.errors):
+            return self.errors[query.INFO]
+        return ARKServerError('6: Partial response',self.errors)
 
 class Translation(): # not used just a param to some classes/functions
     def load_file(self,lang,name='translations'):
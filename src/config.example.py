@@ -4,6 +4,11 @@ class Config:
         self.dbUser = 'root'  # user to the DB
         self.dbPass = 'secret'  # password to the DB
         self.DB = 'bot'  # DB to use in bot
+        self.dbPoolMinSize = 1  # keep at least x connections to the DB open (one pool for the whole bot)
+        self.dbPoolMaxSize = 10  # open at most x connections to the DB (requests wait for a free one)
+        self.dbAcquireTimeout = 10  # fail a request if no connection got free in x seconds
+        self.dbHealthCheckInterval = 60  # ping connection before use if it wasn't used for x seconds
+        self.dbPoolRecycle = 3600  # replace connections older than x seconds
         self.adminId = ''  # not used right now
         self.token = ''  # token of the bot
         self.defaultPrefix = '!'  # default prefix
@@ -14,8 +19,36 @@ class Config:
         self.client_secret = '12131'  # client secret from discord's oauth page
         self.redirect_url = ''  # redirect url to log all users
         self.version = 'DEBUG!'  # version displayed
-        self.workersCount = 5  # x update workers per interation
-        self.updateFrequency = 120  # 1 update loop in x seconds
+        self.workersCount = 5  # x servers are updated at the same time (at start, see below)
+        self.minWorkersCount = 5  # updater never updates less than x servers at the same time
+        self.maxWorkersCount = 500  # updater never updates more than x servers at the same time
+        self.maxLoopLag = 0.1  # lower concurrency if event loop lags more than x seconds
+        self.maxTimeoutRate = 0.05  # lower concurrency if more than x of online servers time out
+        self.updaterProcesses = 0  # update servers in x separate processes (0 - in the bot process)
+        self.shardBatchesInFlight = 4  # send up to x batches to each updater process before it returns them
+        self.updaterLeases = False  # share servers between several bot containers (each one updates servers it leased in DB)
+        self.updaterInstance = ''  # unique name of this updater for leases ('' - host name and process id)
+        self.leaseTime = 120  # lease expires if it isn't renewed in x seconds (must be longer than one loop)
+        self.leaseBatchSize = 500  # lease at most x new servers per loop
+        self.maxLeasedServers = 0  # one updater leases at most x servers (0 - only fair share: servers split evenly between live updaters)
+        self.updateBatchSize = 50  # pass results to plugins and DB in batches of x servers
+        self.updateBatchInterval = 2.0  # or after x seconds if batch isn't full yet
+        self.maxPendingWrites = 2  # at most x batches are written to DB at the same time (updater waits for DB if there are more)
+        self.pingChangeThreshold = 50  # write server to DB only if something but ping changed or ping changed by more than x ms
+        self.playersTimeThreshold = 600  # write players again after x seconds even if the same players are online (their times grow)
+        self.updateFrequency = 120  # update every online server once in x seconds (updates are spread over this time)
+        self.minQueryTimeout = 0.2  # never wait less than x seconds for a server
+        self.maxQueryTimeout = 3.0  # never wait more than x seconds for a server
+        self.maxOfflineInterval = 21600  # update server that doesn't answer at least once in x seconds
+        self.offlineIntervalJitter = 0.2  # randomize interval of offline servers by +-x (0.2 - +-20%)
+        self.watchedIntervalFactor = 0.5  # update servers with auto messages, notifications or recent requests every x of normal interval
+        self.maxUnwatchedIntervalFactor = 4  # others are updated less often to keep the same load but never slower than x of normal interval
+        self.demandWindow = 3600  # /server info makes server watched for x seconds
+        self.rulesRefreshInterval = 3600  # query rules of an online server at least once in x seconds
+        self.packetsPerSecond = 2000  # max A2S packets sent per second (0 - no limit)
+        self.packetsBurst = 200  # max A2S packets sent at once
+        self.perIpPacketsPerSecond = 50  # max A2S packets sent per second to one ip (0 - no limit)
+        self.perIpPacketsBurst = 20  # max A2S packets sent at once to one ip
         self.backupWebhookUrl = ''  # discord webhook url to use in backup script
         self.logsGuildId = 349178138258833418 # id of a guild where bot will send it's logs
         self.logsChannelId = 874715094645346395 # id of a channel where bot will send it's logs
\ No newline at end of file
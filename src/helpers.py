@@ -10,6 +10,8 @@ import mysql.connector
 import asyncio
 from discord.ext import commands
 import aiomysql
+import contextlib
+import time
 import json
 import random
 import aiohttp
@@ -33,17 +35,119 @@ def makeRequest(SQL, params=()):
         return []
 
 
+class DBPool():
+    """
+    Pool of DB connections shared by the whole process (see getPool)
+    * acquire waits at most acquireTimeout seconds for a free connection (asyncio.TimeoutError after that)
+    * connections that weren't used for healthCheckInterval seconds are pinged before use (and reconnected if they are dead)
+    * connections older than recycle seconds are replaced by the pool
+    Stats (see popStats): connections in use, requests waiting for a connection and how long they waited
+    """
+    def __init__(self, pool, acquireTimeout, healthCheckInterval):
+        self.pool = pool # aiomysql pool
+        self.acquireTimeout = acquireTimeout
+        self.healthCheckInterval = healthCheckInterval
+        self.lastUsed = {} # connection -> when it was released last time (monotonic)
+        self.inUse = 0 # connections acquired right now
+        self.waiting = 0 # requests waiting for a connection right now
+        self.resetStats()
+
+    def resetStats(self):
+        self.acquires = 0
+        self.totalLatency = 0.0 # seconds spent waiting for connections
+        self.maxLatency = 0.0
+        self.maxWaiting = 0
+        self.timeouts = 0 # acquires that timed out
+        self.reconnects = 0 # connections that failed health check
+
+    async def acquire(self):
+        start = time.monotonic()
+        self.waiting += 1
+        self.maxWaiting = max(self.maxWaiting, self.waiting)
+        try:
+            conn = await asyncio.wait_for(self.pool.acquire(), self.acquireTimeout)
+        except asyncio.TimeoutError:
+            self.timeouts += 1
+            raise
+        finally:
+            self.waiting -= 1
+        latency = time.monotonic() - start
+        self.acquires += 1
+        self.totalLatency += latency
+        self.maxLatency = max(self.maxLatency, latency)
+        self.inUse += 1
+        # DB could close connection that was idle for a long time
+        last = self.lastUsed.pop(conn, None)
+        if (last != None and time.monotonic() - last > self.healthCheckInterval):
+            try:
+                await conn.ping(reconnect=False)
+            except BaseException:
+                self.reconnects += 1
+                try:
+                    await conn.ping(reconnect=True)
+                except BaseException:
+                    self.release(conn)
+                    raise
+        return conn
+
+    def release(self, conn):
+        self.inUse -= 1
+        if (not conn.closed):
+            self.lastUsed[conn] = time.monotonic()
+        self.pool.release(conn)
+
+    @contextlib.asynccontextmanager
+    async def connection(self):
+        conn = await self.acquire()
+        try:
+            yield conn
+        finally:
+            self.release(conn)
+
+    def popStats(self):
+        '''Returns pool stats since the last call'''
+        stats = {'size': self.pool.size, 'maxSize': self.pool.maxsize, 'inUse': self.inUse,
+                 'waiting': self.waiting, 'maxWaiting': self.maxWaiting, 'acquires': self.acquires,
+                 'avgLatency': self.totalLatency / self.acquires if self.acquires > 0 else 0.0,
+                 'maxLatency': self.maxLatency, 'timeouts': self.timeouts, 'reconnects': self.reconnects}
+        self.resetStats()
+        # forget connections pool closed (recycled)
+        self.lastUsed = {conn: last for conn, last in self.lastUsed.items() if not conn.closed}
+        return stats
+
+
+_pool = None # DBPool of this process (made by getPool)
+_poolLock = None
+
+
+async def getPool():
+    '''Returns connection pool of this process (makes it on first call)'''
+    global _pool, _poolLock
+    if (_pool != None):
+        return _pool
+    if (_poolLock == None):
+        _poolLock = asyncio.Lock()
+    async with _poolLock:
+        # someone could make it while we were waiting
+        if (_pool == None):
+            cfg = config.Config()
+            pool = await aiomysql.create_pool(host=cfg.dbHost, port=3306,
+                                              user=cfg.dbUser, password=cfg.dbPass,
+                                              db=cfg.DB, loop=asyncio.get_running_loop(),
+                                              # https://docs.python.org/3/library/asyncio-eventloop.html#asyncio.get_running_loop
+                                              minsize=cfg.dbPoolMinSize, maxsize=cfg.dbPoolMaxSize,
+                                              pool_recycle=cfg.dbPoolRecycle)
+            _pool = DBPool(pool, cfg.dbAcquireTimeout, cfg.dbHealthCheckInterval)
+    return _pool
+
+
 async def makeAsyncRequest(SQL, params=()):
-    cfg = config.Config()
-    conn = await aiomysql.connect(host=cfg.dbHost, port=3306,
-                                  user=cfg.dbUser, password=cfg.dbPass,
-                                  db=cfg.DB, loop=asyncio.get_running_loop())  
-                                  # https://docs.python.org/3/library/asyncio-eventloop.html#asyncio.get_running_loop
-    async with conn.cursor() as cur:
-        await cur.execute(SQL, params)
-        result = await cur.fetchall()
-        await conn.commit()
-    conn.close()
+    pool = await getPool()
+    async with pool.connection() as conn:
+        async with conn.cursor() as cur:
+            await cur.execute(SQL, params)
+            result = await cur.fetchall()
+            await conn.commit()
     return result
 
 
@@ -28,29 +28,9 @@ from updatePlugins import notifications, automessage
 
 debug = Debuger('main')  # create debuger (see helpers.py)
 conf = config.Config()  # load config
-# set custom status for bot (sadly it isn't possible to put buttons like in user's profiles)
-game = discord.Game('ping me to get prefix')
-# create auto sharded bot with default prefix and no help command
-bot = commands.AutoShardedBot(
-    command_prefix=get_prefix, help_command=None, activity=game)
-debug.debug('Inited DB and Bot!')  # debug into console !
 t = c.Translation()  # load default english translation
-
-# if conf.debug is True asyncio will output additional debug info into logs
-bot.loop.set_debug(conf.debug)
-
-
-# add all cogs
-bot.add_cog(ServerCmd(bot))
-bot.add_cog(cmd.BulkCommands(bot))
-bot.add_cog(admin_cog.Admin(bot))
-bot.add_cog(dbl_cog.TopGG(bot))
-##bot.add_cog(updater.Updater(bot))
-bot.add_cog(updater.NeoUpdater(bot))
-bot.add_cog(campfire.Campfire(bot))
-bot.add_cog(Charcoal(bot))
-bot.add_cog(notifications.NotificationsCog(bot))
-bot.add_cog(automessage.AutoMessageCog(bot))
+# bot is made in main() (updater processes import this file too and must not make a second bot)
+bot = None
 
 
 # ~~~~~~~~~~~~~~~~~~~~~
@@ -60,7 +40,7 @@ bot.add_cog(automessage.AutoMessageCog(bot))
 # !prefix command
 # default permissions check
 @commands.bot_has_permissions(add_reactions=True, read_messages=True, send_messages=True, manage_messages=True, external_emojis=True)
-@bot.command()
+@commands.command()
 async def prefix(ctx, *args):
     if (args.__len__() <= 0):  # if no additional parameters
         # send current prefix and return
@@ -103,7 +83,7 @@ async def prefix(ctx, *args):
 
 
 #main help command
-@bot.command()
+@commands.command()
 async def help(ctx):
     time = datetime(2000, 1, 1, 0, 0, 0, 0)  # get time object
     # set title and timestamp of embed
@@ -144,7 +124,7 @@ async def help(ctx):
     await ctx.send(embed=message)  
 
 # some old command
-@bot.command()
+@commands.command()
 async def share(ctx):
     await ctx.send(t.l['share_msg'].format(conf.inviteUrl))
 
@@ -154,7 +134,6 @@ async def share(ctx):
 
 # used to count executed commands
 # doesn't work at all
-@bot.event
 async def on_command_completion(ctx):
     name = ctx.command.name  # extract name of command
     if (name == 'server'):  # if it is a server command (I am too lazy to chop the into subcommands or smth like that)
@@ -175,7 +154,6 @@ async def on_command_completion(ctx):
     # see admin_cog.py for how this data is used
 
 # will respond for ping of the bot
-@bot.event
 async def on_message(msg):  # on every message
     # if we in DMs  AND it isn't our message
     if msg.guild == None and msg.author != bot.user:
@@ -197,7 +175,6 @@ async def on_message(msg):  # on every message
     await bot.process_commands(msg)  # if not process commands
 
 # on error in some event
-@bot.event
 async def on_error(event, *args, **kwargs):
     # get tuple with exeption and traceback https://docs.python.org/3/library/sys.html#sys.exc_info
     exeption_pack = sys.exc_info()
@@ -289,7 +266,6 @@ async def channelNotFound(ctx, error):
     # send embed 
     await ctx.send(embed=embed)
 
-@bot.event
 async def on_command_error(ctx, error):
     # get original error from d.py error
     # if none it will be set to error itself
@@ -413,4 +389,39 @@ Error : {e}''', bot)
     
 # was causing problems and was using python implementation of asyncio instead of C one (which is faster)
 # nest_asyncio.apply() # patch loop https://pypi.org/project/nest-asyncio/
-bot.run(conf.token)  # get our discord token and FIRE IT UP !
+def main():
+    global bot
+    # set custom status for bot (sadly it isn't possible to put buttons like in user's profiles)
+    game = discord.Game('ping me to get prefix')
+    # create auto sharded bot with default prefix and no help command
+    bot = commands.AutoShardedBot(
+        command_prefix=get_prefix, help_command=None, activity=game)
+    debug.debug('Inited DB and Bot!')  # debug into console !
+
+    # if conf.debug is True asyncio will output additional debug info into logs
+    bot.loop.set_debug(conf.debug)
+
+    # add all cogs
+    bot.add_cog(ServerCmd(bot))
+    bot.add_cog(cmd.BulkCommands(bot))
+    bot.add_cog(admin_cog.Admin(bot))
+    bot.add_cog(dbl_cog.TopGG(bot))
+    ##bot.add_cog(updater.Updater(bot))
+    bot.add_cog(updater.NeoUpdater(bot))
+    bot.add_cog(campfire.Campfire(bot))
+    bot.add_cog(Charcoal(bot))
+    bot.add_cog(notifications.NotificationsCog(bot))
+    bot.add_cog(automessage.AutoMessageCog(bot))
+
+    # commands and events from above
+    for command in (prefix, help, share):
+        bot.add_command(command)
+    for event in (on_command_completion, on_message, on_error, on_command_error):
+        bot.event(event)
+
+    bot.run(conf.token)  # get our discord token and FIRE IT UP !
+
+
+# updater processes import this file too (as __mp_main__), only main process makes and runs the bot
+if __name__ == '__main__':
+    main()
@@ -1,5 +1,6 @@
 import discord
 from helpers import *  # all our helpers
+from registry import getRegistry
 import classes as c
 import asyncio
 import json
@@ -32,23 +33,21 @@ class Selector():
         embed.add_field(name='Map', value=server.map)
         return embed
 
-    async def select(self):
-        reactions = ['⏮️', '\u2B05', '\u2705', '\u27A1',
-                     '⏭️', '\u23F9']  # array with buttons
-        # get guild id
-        GuildId = self.ctx.guild.id
+    # loads servers added to the guild from DB
+    # returns None (and sends error message) if no servers are added
+    async def selectFromDB(self, GuildId):
         # select settings from DB
         data = await makeAsyncRequest('SELECT * FROM settings WHERE GuildId=%s AND Type=0', (GuildId,))
         # if no servers are added
         if (data.__len__() == 0):
             # send error message
             await self.ctx.send(self.l.l['no_servers_added'].format(self.ctx.prefix))
-            return ''  # return
+            return None  # return
         # if no servers are added
         if (data[0][3] == None or data[0][3] == 'null' or data[0][3] == '[null]' or data[0][3] == '[]'):
             # send error message
             await self.ctx.send(self.l.l['no_servers_added'].format(self.ctx.prefix))
-            return ''  # return
+            return None  # return
         else:  # if we have servers added
             Servers = json.loads(data[0][3])  # load them
         statement = "SELECT * FROM servers WHERE Id IN ({})".format(
@@ -59,6 +58,20 @@ class Selector():
         except BaseException as e:
             await sendToMe(statement, self.bot, True)
             raise e
+        return data
+
+    async def select(self):
+        reactions = ['⏮️', '\u2B05', '\u2705', '\u27A1',
+                     '⏭️', '\u23F9']  # array with buttons
+        # get guild id
+        GuildId = self.ctx.guild.id
+        # servers of this guild from updater's registry (if it's loaded)
+        registry = getRegistry(self.bot)
+        data = registry.forGuild(GuildId) if registry != None else None
+        if (data == None):
+            data = await self.selectFromDB(GuildId)
+            if (data == None):
+                return ''
         try:
             self.msg = await self.ctx.send(self.l.l['server_select'], embed=await self.createEmbed(data, 0))
         except IndexError:
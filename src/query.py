@@ -0,0 +1,622 @@
+import asyncio
+import bz2
+import os
+import socket
+import struct
+import sys
+import time
+import resolver
+
+# A2S protocol
+# https://developer.valvesoftware.com/wiki/Server_queries
+
+# headers of a single packet and of a packet that is part of a split response
+SIMPLE_HEADER = -1
+MULTI_HEADER = -2
+
+# request headers
+A2S_INFO_REQUEST = 0x54
+A2S_PLAYER_REQUEST = 0x55
+A2S_RULES_REQUEST = 0x56
+
+# response headers
+A2S_INFO_RESPONSE = 0x49
+A2S_PLAYER_RESPONSE = 0x44
+A2S_RULES_RESPONSE = 0x45
+A2S_CHALLENGE_RESPONSE = 0x41
+
+# kinds of requests the transport can send
+INFO = 'info'
+RULES = 'rules'
+PLAYERS = 'players'
+KINDS = (INFO, RULES, PLAYERS)
+
+# same default as python-a2s
+DEFAULT_TIMEOUT = 3.0
+# how many times server can answer with a challenge before we give up
+CHALLENGE_RETRIES = 3
+
+
+class BrokenMessageError(Exception):
+    """Server sent something that isn't a valid A2S response"""
+    pass
+
+
+class ServerInfo():
+    """A2S_INFO response (field names are the same as in python-a2s)"""
+    pass
+
+
+class PlayerInfo():
+    """One player from A2S_PLAYER response (field names are the same as in python-a2s)"""
+    def __init__(self, index, name, score, duration):
+        self.index = index
+        self.name = name
+        self.score = score
+        self.duration = duration
+
+
+class Reader():
+    """Reads little endian values out of A2S payload"""
+    def __init__(self, data, offset=1):
+        self.data = data
+        self.offset = offset # skip response header by default
+
+    def unpack(self, fmt):
+        value = struct.unpack_from(fmt, self.data, self.offset)[0]
+        self.offset += struct.calcsize(fmt)
+        return value
+
+    def byte(self):
+        return self.unpack('<B')
+
+    def short(self):
+        return self.unpack('<h')
+
+    def long(self):
+        return self.unpack('<l')
+
+    def longlong(self):
+        return self.unpack('<Q')
+
+    def float(self):
+        return self.unpack('<f')
+
+    def char(self):
+        return chr(self.byte())
+
+    def string(self):
+        # strings are null terminated
+        end = self.data.index(b'\x00', self.offset)
+        value = self.data[self.offset:end].decode('utf-8', errors='replace')
+        self.offset = end + 1
+        return value
+
+    def remaining(self):
+        return len(self.data) - self.offset
+
+
+def parseInfo(payload, ping):
+    """Decodes A2S_INFO response into ServerInfo"""
+    reader = Reader(payload)
+    info = ServerInfo()
+    info.protocol = reader.byte()
+    info.server_name = reader.string()
+    info.map_name = reader.string()
+    info.folder = reader.string()
+    info.game = reader.string()
+    info.app_id = reader.short() & 0xFFFF
+    info.player_count = reader.byte()
+    info.max_players = reader.byte()
+    info.bot_count = reader.byte()
+    info.server_type = reader.char()
+    info.platform = reader.char()
+    info.password_protected = reader.byte() == 1
+    info.vac_enabled = reader.byte() == 1
+    info.version = reader.string()
+    # extra data flag (every field after it is optional)
+    edf = reader.byte() if reader.remaining() > 0 else 0
+    info.edf = edf
+    info.port = reader.short() & 0xFFFF if edf & 0x80 else None
+    info.steam_id = reader.longlong() if edf & 0x10 else None
+    if (edf & 0x40):
+        info.stv_port = reader.short() & 0xFFFF
+        info.stv_name = reader.string()
+    info.keywords = reader.string() if edf & 0x20 else ''
+    # game id holds app id in it's lowest 24 bits
+    info.game_id = reader.longlong() if edf & 0x01 else info.app_id
+    info.ping = ping
+    return info
+
+
+class ARKRules():
+    """Rules of ARK server that ARKServer needs (everything else is skipped)"""
+    def __init__(self):
+        self.pve = None # None if server has no SESSIONISPVE_i (not an ARK server)
+        self.clusterName = None
+        self.mods = [] # ids of mods
+
+
+# rules we read
+PVE_RULE = b'SESSIONISPVE_i'
+CLUSTER_RULE = b'ClusterId_s'
+
+
+def parseARKRules(payload):
+    """
+    Decodes A2S_RULES response straight into ARKRules
+    Only needed values are decoded, others are just skipped
+    """
+    count = struct.unpack_from('<h', payload, 1)[0]
+    # one split in C is much faster than looking for every null terminator in python
+    # last chunk is either empty or a rule that was cut off (ARK servers often truncate the rules)
+    chunks = bytes(payload[3:]).split(b'\x00')
+    pairs = min(count, (chunks.__len__() - 1) // 2)
+    rules = ARKRules()
+    mods = {} # position -> id
+    for name, value in zip(chunks[0:pairs * 2:2], chunks[1:pairs * 2:2]):
+        if (name == PVE_RULE):
+            rules.pve = bool(int(value))
+        elif (name == CLUSTER_RULE):
+            rules.clusterName = value.decode('utf-8', errors='replace')
+        # MOD{i}_s: '2263656440:B21AEF7F4B2485EFA15394881AFB84BC'
+        elif (name[:3] == b'MOD' and name[-2:] == b'_s'):
+            index = name[3:-2]
+            if (index.isdigit()):
+                # we need only part before :
+                mods[int(index)] = value.partition(b':')[0].decode('utf-8', errors='replace')
+    # mods go one after another until first gap
+    i = 0
+    while (i in mods):
+        rules.mods.append(mods[i])
+        i += 1
+    return rules
+
+
+def parsePlayers(payload):
+    """Decodes A2S_PLAYER response into list of PlayerInfo"""
+    reader = Reader(payload)
+    count = reader.byte()
+    players = []
+    for i in range(count):
+        players.append(PlayerInfo(reader.byte(), reader.string(), reader.long(), reader.float()))
+    return players
+
+
+class RTTEstimator():
+    """
+    Picks how long to wait for a server based on it's previous round trips
+    (same idea as TCP retransmission timeout https://tools.ietf.org/html/rfc6298)
+    timeout = smoothed rtt + 4 * rtt variation, doubled after every timeout in a row
+    """
+    ALPHA = 1 / 8 # weight of a new sample in smoothed rtt
+    BETA = 1 / 4 # weight of a new sample in rtt variation
+    K = 4 # how many variations to add to smoothed rtt
+
+    def __init__(self, state=None, minTimeout=0.2, maxTimeout=DEFAULT_TIMEOUT):
+        """
+        state - dict returned by state() (None if we know nothing about the server)
+        minTimeout, maxTimeout - bounds of the timeout in seconds
+        """
+        state = state or {}
+        self.srtt = state.get('srtt')
+        self.rttvar = state.get('rttvar')
+        self.backoff = state.get('backoff', 0) # timeouts in a row
+        self.minTimeout = minTimeout
+        self.maxTimeout = maxTimeout
+
+    def timeout(self):
+        # if we never heard from the server wait as long as we can
+        if (self.srtt == None):
+            return self.maxTimeout
+        timeout = (self.srtt + self.K * self.rttvar) * (2 ** self.backoff)
+        return min(max(timeout, self.minTimeout), self.maxTimeout)
+
+    def success(self, rtt):
+        '''Adds a round trip time (in seconds) of a successful query'''
+        if (self.srtt == None):
+            self.srtt = rtt
+            self.rttvar = rtt / 2
+        else:
+            self.rttvar = (1 - self.BETA) * self.rttvar + self.BETA * abs(self.srtt - rtt)
+            self.srtt = (1 - self.ALPHA) * self.srtt + self.ALPHA * rtt
+        self.backoff = 0
+
+    def failure(self):
+        '''Query timed out. Wait longer next time (until we hit max timeout)'''
+        if (self.srtt != None and self.timeout() < self.maxTimeout):
+            self.backoff += 1
+
+    def state(self):
+        '''Returns JSON serializable state to store with the server'''
+        if (self.srtt == None):
+            return {}
+        return {'srtt': round(self.srtt, 4), 'rttvar': round(self.rttvar, 4), 'backoff': self.backoff}
+
+
+# Linux reports ICMP errors of unconnected UDP sockets only through the error queue (see man 7 ip)
+# constants aren't exported by every python version
+RECVERR = sys.platform.startswith('linux')
+IP_RECVERR = getattr(socket, 'IP_RECVERR', 11)
+MSG_ERRQUEUE = getattr(socket, 'MSG_ERRQUEUE', 0x2000)
+# struct sock_extended_err (errno, origin, type, code, pad, info, data)
+EXTENDED_ERR = struct.Struct('=IBBBBII')
+
+
+def openSocket():
+    '''Makes UDP socket for the transport (with IP_RECVERR on Linux so refused requests fail right away)'''
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.setblocking(False)
+    sock.bind(('0.0.0.0', 0))
+    if (RECVERR):
+        try:
+            sock.setsockopt(socket.SOL_IP, IP_RECVERR, 1)
+        except OSError:
+            pass
+    return sock
+
+
+class A2SProtocol(asyncio.DatagramProtocol):
+    """Socket of one request kind. Routes replies to waiting requests by address of the server"""
+    def __init__(self, kind, sock=None):
+        self.kind = kind
+        self.sock = sock # raw socket (to read error queue)
+        self.transport = None
+        self.waiters = {} # (ip, port) -> future waiting for a reply
+        self.fragments = {} # (ip, port) -> parts of split reply received so far
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def connection_lost(self, exc):
+        # fail everyone who is still waiting
+        for waiter in self.waiters.values():
+            if (not waiter.done()):
+                waiter.set_exception(exc or ConnectionError('A2S socket was closed'))
+        self.waiters = {}
+        self.fragments = {}
+
+    def error_received(self, exc):
+        # socket isn't connected to anyone so exc doesn't tell which server it is about
+        # but error queue has address of every packet that caused an error
+        # (without IP_RECVERR requests just time out)
+        if (self.sock == None or not RECVERR):
+            return
+        while True:
+            try:
+                data, ancdata, flags, addr = self.sock.recvmsg(512, 512, MSG_ERRQUEUE)
+            except (BlockingIOError, InterruptedError):
+                return
+            except OSError:
+                return
+            for level, type, cmsg in ancdata:
+                if (level != socket.SOL_IP or type != IP_RECVERR or cmsg.__len__() < EXTENDED_ERR.size):
+                    continue
+                code = EXTENDED_ERR.unpack_from(cmsg)[0]
+                waiter = self.waiters.get(addr[:2]) if addr != None else None
+                if (waiter != None and not waiter.done()):
+                    # ECONNREFUSED becomes ConnectionRefusedError, EHOSTUNREACH - OSError and so on
+                    waiter.set_exception(OSError(code, os.strerror(code)))
+
+    def send(self, packet, key):
+        if (self.sock == None or not RECVERR):
+            self.transport.sendto(packet, key)
+            return
+        try:
+            self.sock.sendto(packet, key)
+        except (BlockingIOError, InterruptedError):
+            # socket buffer is full, transport will send it later
+            self.transport.sendto(packet, key)
+        except OSError as e:
+            # error of a packet to another server is pending (sendto reports it and drops our packet)
+            # read error queue and try again
+            self.error_received(e)
+            self.transport.sendto(packet, key)
+
+    def wait(self, key):
+        waiter = asyncio.get_running_loop().create_future()
+        self.waiters[key] = waiter
+        return waiter
+
+    def forget(self, key):
+        self.waiters.pop(key, None)
+        self.fragments.pop(key, None)
+
+    def datagram_received(self, data, addr):
+        key = addr[:2]
+        waiter = self.waiters.get(key)
+        # nobody waits for this reply (late or unsolicited)
+        if (waiter == None or waiter.done()):
+            return
+        try:
+            payload = self.reassemble(key, data)
+        except (struct.error, ValueError, KeyError, OSError) as e:
+            waiter.set_exception(BrokenMessageError(f'Broken packet from {key}: {e}'))
+            return
+        # reply isn't complete yet
+        if (payload == None):
+            return
+        waiter.set_result((payload, time.monotonic()))
+
+    def reassemble(self, key, data):
+        '''
+        Returns payload of the reply without the header
+        or None if we need more packets of a split reply
+        '''
+        header = struct.unpack_from('<l', data)[0]
+        if (header == SIMPLE_HEADER):
+            return data[4:]
+        if (header != MULTI_HEADER):
+            raise ValueError(f'unknown header {header}')
+        # Source engine split packet
+        # id, total packets, number of this packet, max packet size
+        packetId, total, number = struct.unpack_from('<lBB', data, 4)
+        parts = self.fragments.setdefault(key, {})
+        parts[number] = data[12:]
+        if (len(parts) < total):
+            return None
+        payload = b''.join(parts[i] for i in range(total))
+        self.fragments.pop(key, None)
+        # highest bit of the id means that payload is bzip2 compressed
+        if (packetId & 0x80000000):
+            # skip decompressed size and crc32
+            payload = bz2.decompress(payload[8:])
+        return payload[4:]
+
+
+class PacketScheduler():
+    """
+    Limits rate of outgoing packets so a burst of requests doesn't overflow socket buffers
+    Token bucket for all packets plus one for every destination ip
+    (official servers have many ports on one ip and throttle floods)
+    Implemented as GCRA (virtual scheduling): every packet reserves the time it can be sent
+    so each sender sleeps at most once
+    rate - packets per second (0 means no limit), burst - how many packets can be sent at once
+    """
+    def __init__(self, rate=0, burst=1, perIpRate=0, perIpBurst=1):
+        self.rate = rate
+        self.burst = burst
+        self.perIpRate = perIpRate
+        self.perIpBurst = perIpBurst
+        self.globalTat = 0.0 # theoretical arrival time of the next packet
+        self.ipTats = {} # ip -> theoretical arrival time of the next packet to that ip
+        self.resetStats()
+
+    def resetStats(self):
+        self.packets = 0 # packets sent
+        self.delayed = 0 # packets that had to wait
+        self.totalDelay = 0.0 # seconds spent in the queue
+        self.maxDelay = 0.0
+
+    def popStats(self):
+        '''Returns queue delay stats since the last call'''
+        stats = {'packets': self.packets, 'delayed': self.delayed,
+                 'avgDelay': self.totalDelay / self.packets if self.packets > 0 else 0.0,
+                 'maxDelay': self.maxDelay}
+        self.resetStats()
+        return stats
+
+    @staticmethod
+    def mergeStats(stats):
+        '''Combines popStats() of several schedulers (e.g. of updater processes)'''
+        packets = sum(i['packets'] for i in stats)
+        return {'packets': packets, 'delayed': sum(i['delayed'] for i in stats),
+                'avgDelay': sum(i['avgDelay'] * i['packets'] for i in stats) / packets if packets > 0 else 0.0,
+                'maxDelay': max([i['maxDelay'] for i in stats], default=0.0)}
+
+    @staticmethod
+    def sendTime(tat, now, rate, burst):
+        '''When a packet can be sent according to a bucket'''
+        if (rate <= 0):
+            return now
+        return max(now, tat - (burst - 1) / rate)
+
+    @staticmethod
+    def reserve(tat, sendAt, rate):
+        '''Returns new theoretical arrival time after a packet is sent at sendAt'''
+        if (rate <= 0):
+            return tat
+        return max(tat, sendAt) + 1 / rate
+
+    async def acquire(self, ip):
+        '''Waits until a packet to the ip can be sent'''
+        now = time.monotonic()
+        ipTat = self.ipTats.get(ip, 0.0)
+        # packet must fit into both buckets
+        sendAt = max(self.sendTime(self.globalTat, now, self.rate, self.burst),
+                     self.sendTime(ipTat, now, self.perIpRate, self.perIpBurst))
+        self.globalTat = self.reserve(self.globalTat, sendAt, self.rate)
+        if (self.perIpRate > 0):
+            self.ipTats[ip] = self.reserve(ipTat, sendAt, self.perIpRate)
+            # forget ips we haven't sent anything to for a while
+            if (self.ipTats.__len__() > 10000):
+                self.ipTats = {key: tat for key, tat in self.ipTats.items() if tat > now}
+        self.packets += 1
+        delay = sendAt - now
+        if (delay > 0):
+            self.delayed += 1
+            self.totalDelay += delay
+            self.maxDelay = max(self.maxDelay, delay)
+            await asyncio.sleep(delay)
+
+
+class A2STransport():
+    """
+    Long lived UDP sockets shared by all A2S queries.
+    There is one socket per request kind so a reply is routed
+    to the waiting coroutine by the socket it came to and by (address, port) it came from
+    """
+    def __init__(self):
+        self.protocols = {} # kind -> A2SProtocol
+        self.inflight = {} # (kind, ip, port) -> task that is already querying that server
+        # (is info request, ip, port) -> last challenge number the server gave us
+        # rules and players share the same challenge so they share the entry
+        self.challenges = {}
+        self.scheduler = PacketScheduler(**_limits) # limits rate of outgoing packets
+        self.startTask = None
+        self.loop = None # loop the sockets belong to
+        self.closed = False
+
+    async def start(self):
+        # create sockets only once even if many queries are started at the same time
+        if (self.startTask == None):
+            self.startTask = asyncio.ensure_future(self.open())
+        await self.startTask
+
+    async def open(self):
+        loop = asyncio.get_running_loop()
+        self.loop = loop
+        for kind in KINDS:
+            sock = openSocket()
+            transport, protocol = await loop.create_datagram_endpoint(
+                lambda: A2SProtocol(kind, sock), sock=sock)
+            self.protocols[kind] = protocol
+
+    def close(self):
+        self.closed = True
+        for protocol in self.protocols.values():
+            if (protocol.transport != None):
+                protocol.transport.close()
+
+    async def resolve(self, address):
+        # replies come from an ip so hostnames must be resolved before sending
+        # raises socket.gaierror just like python-a2s does
+        return await resolver.resolve(address)
+
+    def packet(self, kind, challenge):
+        '''Makes a request packet'''
+        header = struct.pack('<l', SIMPLE_HEADER)
+        if (kind == INFO):
+            packet = header + bytes([A2S_INFO_REQUEST]) + b'Source Engine Query\x00'
+            # info request gets challenge only if server asked for it
+            if (challenge != None):
+                packet += struct.pack('<l', challenge)
+            return packet
+        requestType = A2S_RULES_REQUEST if kind == RULES else A2S_PLAYER_REQUEST
+        # -1 asks server for a challenge number
+        return header + bytes([requestType]) + struct.pack('<l', -1 if challenge == None else challenge)
+
+    async def exchange(self, protocol, key, packet, timeout):
+        '''Sends one packet and waits for a complete reply. Returns (payload, rtt)'''
+        waiter = protocol.wait(key)
+        try:
+            # wait for our turn (time in queue doesn't count towards timeout)
+            await self.scheduler.acquire(key[0])
+            sent = time.monotonic()
+            protocol.send(packet, key)
+            payload, received = await asyncio.wait_for(waiter, timeout)
+        finally:
+            protocol.forget(key)
+        return payload, received - sent
+
+    async def request(self, kind, key, timeout):
+        protocol = self.protocols[kind]
+        expected = {INFO: A2S_INFO_RESPONSE, RULES: A2S_RULES_RESPONSE, PLAYERS: A2S_PLAYER_RESPONSE}[kind]
+        challengeKey = (kind == INFO,) + key
+        # use challenge from the last cycle so we don't need to ask for a new one
+        challenge = self.challenges.get(challengeKey)
+        ping = None
+        for attempt in range(CHALLENGE_RETRIES + 1):
+            try:
+                payload, rtt = await self.exchange(protocol, key, self.packet(kind, challenge), timeout)
+            except asyncio.TimeoutError:
+                # some servers silently drop requests with an outdated challenge
+                # so ask for a fresh one next time
+                self.challenges.pop(challengeKey, None)
+                raise
+            # ping is time of the first round trip (like in python-a2s)
+            if (ping == None):
+                ping = rtt
+            if (len(payload) == 0):
+                raise BrokenMessageError(f'Empty response from {key}')
+            responseType = payload[0]
+            # server wants us to repeat the request with a (new) challenge
+            if (responseType == A2S_CHALLENGE_RESPONSE):
+                challenge = struct.unpack_from('<l', payload, 1)[0]
+                # remember it for the next time
+                self.challenges[challengeKey] = challenge
+                continue
+            if (responseType != expected):
+                raise BrokenMessageError(f'Invalid response type: {hex(responseType)}')
+            try:
+                if (kind == INFO):
+                    return parseInfo(payload, ping)
+                elif (kind == RULES):
+                    return parseARKRules(payload)
+                else:
+                    return parsePlayers(payload)
+            except (struct.error, ValueError) as e:
+                raise BrokenMessageError(f'Can`t decode {kind} response from {key}: {e}')
+        raise BrokenMessageError('Server keeps sending challenge responses')
+
+    def finished(self, name, task):
+        self.inflight.pop(name, None)
+        # mark exception as retrieved in case every caller was cancelled
+        if (not task.cancelled()):
+            task.exception()
+
+    async def query(self, kind, address, port, timeout=DEFAULT_TIMEOUT):
+        await self.start()
+        ip = await self.resolve(address)
+        name = (kind, ip, port)
+        # only one request of each kind can wait for a server at a time
+        # so everyone else who asks for the same thing gets the same result
+        task = self.inflight.get(name)
+        if (task == None):
+            task = asyncio.ensure_future(self.request(kind, (ip, port), timeout))
+            self.inflight[name] = task
+            task.add_done_callback(lambda t: self.finished(name, t))
+        # shield so that one cancelled caller doesn't cancel request of the others
+        return await asyncio.shield(task)
+
+
+# transport shared by the whole process
+_transport = None
+
+# limits for schedulers of new transports (see configure)
+_limits = {}
+
+
+def configure(rate=0, burst=1, perIpRate=0, perIpBurst=1):
+    '''Sets outgoing packet rate limits of the shared transport'''
+    _limits.update(rate=rate, burst=burst, perIpRate=perIpRate, perIpBurst=perIpBurst)
+    if (_transport != None):
+        _transport.scheduler = PacketScheduler(**_limits)
+
+
+def getTransport():
+    '''Returns shared A2S transport (creates it if needed)'''
+    global _transport
+    # sockets can't be shared between event loops
+    if (_transport == None or _transport.closed or
+            (_transport.loop != None and _transport.loop != asyncio.get_event_loop())):
+        _transport = A2STransport()
+    return _transport
+
+
+async def info(address, port, timeout=DEFAULT_TIMEOUT):
+    '''Same as a2s.ainfo but over the shared transport'''
+    return await getTransport().query(INFO, address, port, timeout)
+
+
+async def rules(address, port, timeout=DEFAULT_TIMEOUT):
+    '''Like a2s.arules but over the shared transport. Returns ARKRules'''
+    return await getTransport().query(RULES, address, port, timeout)
+
+
+async def players(address, port, timeout=DEFAULT_TIMEOUT):
+    '''Same as a2s.aplayers but over the shared transport'''
+    return await getTransport().query(PLAYERS, address, port, timeout)
+
+
+async def queryAll(address, port, timeouts=None, kinds=KINDS):
+    '''
+    Sends requests of all kinds to a server at once
+    Every request has it's own deadline: timeouts - dict kind -> seconds
+    Returns dict kind -> response (or exception if that request failed)
+    '''
+    transport = getTransport()
+    timeouts = timeouts or {}
+    coroutines = [transport.query(kind, address, port, timeouts.get(kind, DEFAULT_TIMEOUT)) for kind in kinds]
+    results = await asyncio.gather(*coroutines, return_exceptions=True)
+    return dict(zip(kinds, results))
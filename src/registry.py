@@ -0,0 +1,107 @@
+import json
+
+# settings.Type
+GUILD = 0
+DM = 1
+
+
+class ServerRegistry():
+    """
+    In memory copy of `servers` table owned by the updater
+    (with updaterLeases only servers this updater leased, others aren't found and are read from DB)
+    Records are the same tuples `SELECT * FROM servers` returns
+    * records - by Id
+    * ips - Ip -> Id
+    * guilds - (GuildId, Type) -> list of ids added to that guild (from `settings` table)
+    All lookups are O(1)
+    """
+    def __init__(self):
+        self.records = {} # id -> record
+        self.ips = {} # ip -> id
+        self.guilds = {} # (guild id, type) -> list of server ids
+        self.loaded = False # true after the table was loaded once
+
+    def __len__(self):
+        return self.records.__len__()
+
+    def __contains__(self, id):
+        return id in self.records
+
+    def ids(self):
+        return list(self.records)
+
+    def get(self, id):
+        '''Returns server record by it's id (None if not found)'''
+        return self.records.get(id)
+
+    def getByIp(self, ip):
+        '''Returns server record by it's ip ("ip:port") (None if not found)'''
+        id = self.ips.get(ip)
+        if (id == None):
+            return None
+        return self.records.get(id)
+
+    def getMany(self, ids):
+        '''Returns records of the servers in the same order (skips unknown ids)'''
+        return [self.records[id] for id in ids if id in self.records]
+
+    def forGuild(self, guildId, type=GUILD):
+        '''
+        Returns records of servers added to a guild
+        None if guild has no settings or some of it's servers aren't loaded yet (ask DB then)
+        '''
+        ids = self.guilds.get((guildId, type))
+        if (ids == None):
+            return None
+        records = self.getMany(ids)
+        if (records.__len__() != ids.__len__()):
+            return None
+        return records
+
+    def put(self, record):
+        '''Adds or replaces a record'''
+        old = self.records.get(record[0])
+        # ip could be changed
+        if (old != None and self.ips.get(old[1]) == old[0]):
+            del self.ips[old[1]]
+        self.records[record[0]] = record
+        self.ips[record[1]] = record[0]
+
+    def remove(self, id):
+        record = self.records.pop(id, None)
+        if (record != None and self.ips.get(record[1]) == id):
+            del self.ips[record[1]]
+
+    def store(self, id, lastOnline, offlineTrys, serverObj, playersObj, info):
+        '''Updates fields updater writes (does nothing if server was deleted)'''
+        record = self.records.get(id)
+        if (record == None):
+            return
+        self.records[id] = tuple(record[:4]) + (serverObj, playersObj, lastOnline, offlineTrys, info) + tuple(record[9:])
+
+    def setGuild(self, guildId, type, ids):
+        '''Sets list of server ids added to a guild (call after changing settings.ServersId)'''
+        self.guilds[(guildId, type)] = list(ids)
+
+    def loadGuilds(self, settings):
+        '''Rebuilds guild index from (GuildId, Type, ServersId) rows'''
+        self.guilds = {}
+        self.updateGuilds(settings)
+
+    def updateGuilds(self, settings):
+        '''Replaces guilds of these (GuildId, Type, ServersId) rows in the index'''
+        for guildId, type, serversIds in settings:
+            try:
+                ids = json.loads(serversIds) if serversIds != None else []
+            except ValueError:
+                ids = []
+            # some rows have 'null' or '[null]'
+            self.guilds[(guildId, type)] = [id for id in (ids or []) if id != None]
+
+
+def getRegistry(bot):
+    '''Returns registry of the running updater (None if it isn't loaded yet)'''
+    updater = bot.get_cog('NeoUpdater')
+    if (updater == None or not updater.registry.loaded):
+        return None
+    return updater.registry
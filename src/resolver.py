@@ -0,0 +1,129 @@
+import asyncio
+import ipaddress
+import socket
+import time
+import aiodns
+
+
+class CacheEntry():
+    """Cached answer (or failure) for one host name"""
+    def __init__(self, ip, expires, staleUntil, error=None):
+        self.ip = ip # resolved ip (None if lookup failed)
+        self.expires = expires # time when we need to resolve the name again
+        self.staleUntil = staleUntil # time until we can use the ip if resolving fails
+        self.error = error # why lookup failed
+
+
+class Resolver():
+    """
+    Async DNS resolver with a cache shared by all queries
+    * answers are cached for their TTL
+    * failures are cached for negativeTTL seconds
+    * concurrent lookups of the same name share one DNS query
+    * expired answer is returned right away while it is refreshed in background
+      and is kept if the refresh fails (stale while revalidate)
+    """
+    def __init__(self, minTTL=30, maxTTL=3600, negativeTTL=60, staleTTL=86400):
+        """
+        minTTL, maxTTL - bounds for TTL of DNS answers (seconds)
+        negativeTTL - how long to remember that a name can't be resolved (seconds)
+        staleTTL - how long expired answer can be used if resolver fails (seconds)
+        """
+        self.minTTL = minTTL
+        self.maxTTL = maxTTL
+        self.negativeTTL = negativeTTL
+        self.staleTTL = staleTTL
+        self.cache = {} # name -> CacheEntry
+        self.pending = {} # name -> task that resolves the name right now
+        self.resolver = None # created on first use (needs running loop)
+        self.loop = None
+
+    async def resolve(self, name):
+        '''
+        Returns ip address for a host name
+        Raises socket.gaierror if it can't be resolved
+        '''
+        # ip addresses don't need resolving
+        try:
+            ipaddress.IPv4Address(name)
+            return name
+        except ValueError:
+            pass
+        now = time.monotonic()
+        entry = self.cache.get(name)
+        if (entry != None):
+            # fresh answer
+            if (entry.expires > now):
+                if (entry.ip == None):
+                    raise socket.gaierror(socket.EAI_NONAME, f'Can`t resolve {name}: {entry.error}')
+                return entry.ip
+            # expired answer: use it and refresh in background
+            if (entry.ip != None and entry.staleUntil > now):
+                self.refresh(name)
+                return entry.ip
+        return await asyncio.shield(self.refresh(name))
+
+    def refresh(self, name):
+        '''Starts lookup of the name (or returns lookup that is already running)'''
+        task = self.pending.get(name)
+        if (task == None):
+            task = asyncio.ensure_future(self.lookup(name))
+            self.pending[name] = task
+            task.add_done_callback(lambda t: self.finished(name, t))
+        return task
+
+    def finished(self, name, task):
+        self.pending.pop(name, None)
+        # background refreshes are never awaited
+        if (not task.cancelled()):
+            task.exception()
+
+    async def query(self, name):
+        '''Returns (ip, ttl)'''
+        if (self.resolver == None):
+            self.loop = asyncio.get_running_loop()
+            self.resolver = aiodns.DNSResolver(loop=self.loop)
+        try:
+            answers = await self.resolver.query(name, 'A')
+            return answers[0].host, min(answer.ttl for answer in answers)
+        except aiodns.error.DNSError:
+            # names from /etc/hosts (like docker service names) aren't in DNS
+            # and gethostbyname gives no TTL
+            answer = await self.resolver.gethostbyname(name, socket.AF_INET)
+            return answer.addresses[0], self.minTTL
+
+    async def lookup(self, name):
+        now = time.monotonic()
+        try:
+            ip, ttl = await self.query(name)
+        except (aiodns.error.DNSError, IndexError) as e:
+            entry = self.cache.get(name)
+            # resolver failed but we still have an old answer
+            if (entry != None and entry.ip != None and entry.staleUntil > now):
+                # try again later
+                entry.expires = now + self.negativeTTL
+                return entry.ip
+            self.cache[name] = CacheEntry(None, now + self.negativeTTL, now, e)
+            raise socket.gaierror(socket.EAI_NONAME, f'Can`t resolve {name}: {e}')
+        ttl = min(max(ttl, self.minTTL), self.maxTTL)
+        self.cache[name] = CacheEntry(ip, now + ttl, now + ttl + self.staleTTL)
+        return ip
+
+
+# resolver shared by the whole process
+_resolver = None
+
+
+def getResolver():
+    '''Returns shared resolver (creates it if needed)'''
+    global _resolver
+    # aiodns channel can't be shared between event loops
+    if (_resolver == None or
+            (_resolver.loop != None and _resolver.loop != asyncio.get_event_loop())):
+        _resolver = Resolver()
+    return _resolver
+
+
+async def resolve(name):
+    '''Resolves host name using shared resolver'''
+    return await getResolver().resolve(name)
@@ -1,6 +1,7 @@
 from helpers import *
 import classes as c
 from menus import *
+from registry import getRegistry
 import discord  # main discord libary
 from discord.ext import commands  # import commands extension
 import json
@@ -15,6 +16,12 @@ class ServerCmd(commands.Cog):
         self.cfg = config.Config()
         self.bot = bot
 
+    # keeps updater's registry in sync after settings.ServersId is changed
+    def setGuildServers(self, guildId, type, ids):
+        registry = getRegistry(self.bot)
+        if (registry != None):
+            registry.setGuild(guildId, type, ids)
+
     async def serverInfo(self, serverRecord, ctx):
         # get list of player from server record
         playersList = c.PlayersList.fromJSON(serverRecord[5])
@@ -117,6 +124,7 @@ class ServerCmd(commands.Cog):
             if data.__len__() <= 0:  # if we have no settings for that guild
                 # create it
                 await makeAsyncRequest('INSERT INTO settings(GuildId, ServersId, Type) VALUES (%s,%s,0)', (ctx.guild.id, json.dumps([Id]),))
+                self.setGuildServers(ctx.guild.id, 0, [Id])
                 await ctx.send('Done!')
             else:  # else
                 if (data[0][3] == None or data[0][3] == 'null'):  # if no servers are added
@@ -126,6 +134,7 @@ class ServerCmd(commands.Cog):
                 ids.append(Id)  # append current server id to the list
                 # update settings for guild
                 await makeAsyncRequest('UPDATE settings SET ServersId=%s WHERE GuildId=%s AND Type=0', (json.dumps(ids), ctx.guild.id,))
+                self.setGuildServers(ctx.guild.id, 0, ids)
                 await ctx.send('Done!')  # done
 
         elif (mode == 'info'):  # if /server info
@@ -135,10 +144,17 @@ class ServerCmd(commands.Cog):
             if server == '':  # if user didn't  selected server
                 return  # return
             ip = server.ip  # else get ip
-            # get server by ip
-            servers = await makeAsyncRequest('SELECT * FROM servers WHERE Ip=%s', (ip,))
-            # get first match
-            server = servers[0]
+            # get server by ip (from updater's registry if it has it)
+            registry = getRegistry(self.bot)
+            server = registry.getByIp(ip) if registry != None else None
+            if (server == None):
+                servers = await makeAsyncRequest('SELECT * FROM servers WHERE Ip=%s', (ip,))
+                # get first match
+                server = servers[0]
+            # let the updater know that someone is interested in this server
+            updater = self.bot.get_cog('NeoUpdater')
+            if (updater != None):
+                updater.noteRequest(server[0])
             await self.serverInfo(server, ctx)
         elif (mode == 'delete'):  # add !exec "delete from notifications where ServersIds like '%4%'"
             selector = Selector(ctx, self.bot, lang)
@@ -163,6 +179,7 @@ class ServerCmd(commands.Cog):
             serverIds.remove(serverId)
             await makeAsyncRequest('UPDATE settings SET ServersId=%s WHERE GuildId=%s AND Type=%s',
                         (json.dumps(serverIds), GuildId, Type))
+            self.setGuildServers(GuildId, Type, serverIds)
             await ctx.send('Done!')
         elif (mode == 'alias'):  # if we need to add or delete alias
             if ('delete' in args):  # delete alias
@@ -0,0 +1,117 @@
+'''
+Worker process of sharded updater (see NeoUpdater.shardWorker)
+Every process owns servers of some hosts (see NeoUpdater.shardOf), runs it's own event loop
+and A2S sockets and sends back results that are ready to be saved
+Processes are started by forkserver so they don't get sockets and running loop of the bot
+(multiprocessing imports main.py in them as __mp_main__, bot and cogs are made only by main.main())
+Event loop runs in it's own thread for the whole life of the process,
+bot sends servers with submit() and takes whatever is done with collect() (several batches can be in flight)
+'''
+import asyncio
+import queue
+import threading
+import traceback
+import config
+import query
+import updater
+
+# state of this process
+_loop = None
+_updater = None
+_finished = None # (server id, result) of finished updates (result is None if update crashed)
+_level = 1 # how many servers can be updated at the same time
+_active = 0 # updates running right now
+_slotFreed = None # asyncio.Condition notified when _active or _level changes
+
+
+class ShardUpdater(updater.ServerUpdater):
+    """ServerUpdater that collects errors to send them to the bot process"""
+    def __init__(self, cfg):
+        super().__init__(cfg)
+        self.errors = queue.Queue() # tracebacks of unexpected errors (put by loop thread)
+
+    def reportError(self, e, serverRecord):
+        errors = ''.join(traceback.format_exception(type(e), e, e.__traceback__))
+        self.errors.put(f'Server failed!\nId:{serverRecord[0]} ,Ip:{serverRecord[1]}\n{errors}')
+
+
+async def setup():
+    global _slotFreed
+    _slotFreed = asyncio.Condition()
+
+
+def init(limits):
+    '''Called once in every new process'''
+    global _loop, _updater, _finished
+    _finished = queue.Queue()
+    # every shard gets it's part of packet rate
+    query.configure(*limits)
+    _updater = ShardUpdater(config.Config())
+    _loop = asyncio.new_event_loop()
+    threading.Thread(target=_loop.run_forever, name='shard loop', daemon=True).start()
+    asyncio.run_coroutine_threadsafe(setup(), _loop).result()
+
+
+def ready():
+    '''Used to start the process before first batch'''
+    return True
+
+
+async def setLevel(concurrency):
+    global _level
+    async with _slotFreed:
+        _level = concurrency
+        _slotFreed.notify_all()
+
+
+async def one(record):
+    global _active
+    async with _slotFreed:
+        await _slotFreed.wait_for(lambda: _active < _level)
+        _active += 1
+    try:
+        # only what bot process doesn't have (see UpdateResult.compact)
+        result = (await _updater.updateServer(record)).compact()
+    except BaseException as e: # e.g. broken JSON in the record
+        _updater.reportError(e, record)
+        result = None
+    finally:
+        async with _slotFreed:
+            _active -= 1
+            _slotFreed.notify()
+    _finished.put((record[0], result))
+
+
+def submit(records, concurrency):
+    '''Starts updates of servers (returns right away, results are taken by collect)'''
+    # controller's level can change between batches
+    asyncio.run_coroutine_threadsafe(setLevel(concurrency), _loop).result()
+    for record in records:
+        asyncio.run_coroutine_threadsafe(one(record), _loop)
+
+
+async def packetStats():
+    return query.getTransport().scheduler.popStats()
+
+
+def collect(wait):
+    '''
+    Waits up to wait seconds for at least one finished update
+    Returns (list of (server id, UpdateResult.compact() or None if update crashed), list of errors, packet stats since last call)
+    '''
+    results = []
+    try:
+        results.append(_finished.get(timeout=wait))
+        while True:
+            results.append(_finished.get_nowait())
+    except queue.Empty:
+        pass
+    errors = []
+    try:
+        while True:
+            errors.append(_updater.errors.get_nowait())
+    except queue.Empty:
+        pass
+    # transport belongs to the loop thread
+    packets = asyncio.run_coroutine_threadsafe(packetStats(), _loop).result()
+    return results, errors, packets
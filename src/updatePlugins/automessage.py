@@ -366,6 +366,8 @@ class AutoMessagesPlugin():
         # same embed generating function
         self.generator = AutoMessageCog(self.updater.bot)
         self.updatedMessages = 0
+        # ids of servers updated since last refresh
+        self.updatedServers = set()
 
     # will be ran by main updater just like regular __init__
     async def init(self):
@@ -374,11 +376,19 @@ class AutoMessagesPlugin():
     async def refresh(self):  
         # TODO: add "smart" deletion of broken records
         # e.g. count how many times we tried to update that record 
-        self.updatedMessages = 0 
+        # only servers that were updated need new messages
+        # (loop runs more often than each server is updated)
+        updatedServers = self.updatedServers
+        self.updatedServers = set()
+        if (updatedServers.__len__() == 0):
+            return
         # get all messages
         messages = await self.updater.makeAsyncRequest('SELECT * FROM automessages')
         # for each record
         for message in messages:
+            # nothing new for this server
+            if (message[3] not in updatedServers):
+                continue
             # get guild from record
             guild = self.bot.get_guild(message[5])
             # if we can't get guild
@@ -417,7 +427,12 @@ class AutoMessagesPlugin():
         asyncio.create_task(self.refresh())
 
     async def loopEnd(self):
+        # updater reports once per updateFrequency and not on every loop
+        if (not self.updater.reportDue):
+            return
         await sendToMe(f'Updated {self.updatedMessages} auto messages!', self.bot)
+        self.updatedMessages = 0
 
     async def handle(self,updateResults):
-        pass
+        # remember which servers got new data
+        self.updatedServers.update(result.Id for result in updateResults)
@@ -1,4 +1,5 @@
 import classes as c  # our classes
+import query  # A2S query layer
 from helpers import *  # our helpers
 import config  # config
 import discord  # main discord libary
@@ -14,9 +15,19 @@ import io
 import traceback
 import socket
 import menus as m
+from registry import ServerRegistry
 import concurrent.futures._base as base
 import asyncio
 import aiohttp
+import statistics
+import heapq
+import zlib
+import math
+import collections
+import random
+import multiprocessing
+import concurrent.futures
+import concurrent.futures.process
 from updatePlugins.automessage import AutoMessagesPlugin
 from updatePlugins.battlemetrics import BattlemetricsPlugin
 from updatePlugins.notifications import NotificationsPlugin
@@ -69,10 +80,27 @@ class UpdateResult(c.JSON):
         self.cachedPlayers = c.PlayersList.fromJSON(serverRecord[5])
         self.Id = serverRecord[0] # id of the server in DB
         self.moreInfo = json.loads(serverRecord[8]) # decode JSON with more info from DB
+        self.encoded = None # (ServerObj, PlayersObj) JSON if it was already made (by shard process)
 
     def successful(self):
         return self.result
 
+    def compact(self):
+        '''Only what shard process has to send back (bot process makes the rest out of the record, see fromCompact)'''
+        encoded = None
+        if (self.serverObj != None and self.playersObj != None):
+            encoded = (self.serverObj.toJSON(), self.playersObj.toJSON())
+        return (self.result, encoded, self.reason, self.moreInfo)
+
+    @classmethod
+    def fromCompact(cls, data, serverRecord):
+        result, encoded, reason, moreInfo = data
+        serverObj, playersObj = (c.ARKServer.fromJSON(encoded[0]), c.PlayersList.fromJSON(encoded[1])) if encoded != None else (None, None)
+        self = cls(result, serverObj, playersObj, serverRecord, reason)
+        self.moreInfo = moreInfo # could be changed by the update (rtt, rulesUpdated)
+        self.encoded = encoded
+        return self
+
     def __repr__(self):
         repr = f'''
 Update result for server {self.Id} ({self.ip})
@@ -84,25 +112,577 @@ Fail reason: {self.reason}
     
 
 
-class NeoUpdater(commands.Cog):
+class ConcurrencyController():
+    """
+    Picks how many servers are updated at the same time (AIMD)
+    After every window of updates:
+    * if servers that were online don't time out, ping doesn't grow and event loop isn't lagging
+      concurrency is increased by increaseStep
+    * else it is multiplied by decreaseFactor
+    Level always stays between minimum and maximum
+    """
+    def __init__(self, level, minimum, maximum, maxLoopLag, maxTimeoutRate,
+                 increaseStep=5, decreaseFactor=0.5, rttFactor=2.0):
+        self.minimum = minimum
+        self.maximum = maximum
+        self.level = min(max(level, minimum), maximum) # current concurrency
+        self.maxLoopLag = maxLoopLag # seconds
+        self.maxTimeoutRate = maxTimeoutRate # part of online servers that can time out
+        self.increaseStep = increaseStep
+        self.decreaseFactor = decreaseFactor
+        self.rttFactor = rttFactor # how much median ping can grow over the baseline
+        self.baselineRtt = None # lowest median ping we saw (ms)
+        self.active = 0 # updates running right now
+        self.waiters = collections.deque() # futures of workers waiting for a free slot
+        self.resetWindow()
+
+    def start(self):
+        '''Prepares controller for new update cycle'''
+        self.active = 0
+        self.waiters = collections.deque()
+        self.resetWindow()
+
+    def resetWindow(self):
+        self.completed = 0 # updates finished in this window
+        self.expected = 0 # servers that were online last time
+        self.timeouts = 0 # servers that were online last time but timed out
+        self.rtts = [] # pings of successful updates
+        self.lag = 0.0 # max event loop lag in this window
+
+    async def acquire(self):
+        '''Waits until one more update can be started'''
+        if (self.active < self.level and self.waiters.__len__() == 0):
+            self.active += 1
+            return
+        waiter = asyncio.get_running_loop().create_future()
+        self.waiters.append(waiter)
+        try:
+            # wake() counts us as active before it wakes us
+            await waiter
+        except asyncio.CancelledError:
+            if (waiter.done() and not waiter.cancelled()):
+                # slot was given to us but we won't use it
+                await self.release()
+            elif (waiter in self.waiters):
+                # wake() could have dropped it already (it skips cancelled waiters)
+                self.waiters.remove(waiter)
+            raise
+
+    async def release(self):
+        self.active -= 1
+        self.wake()
+
+    def wake(self):
+        '''Wakes as many waiting workers as there are free slots (one by one, not everyone)'''
+        while (self.active < self.level and self.waiters.__len__() > 0):
+            waiter = self.waiters.popleft()
+            if (not waiter.done()):
+                self.active += 1
+                waiter.set_result(None)
+
+    async def monitorLag(self, interval=0.1):
+        '''Measures how late event loop wakes us up (runs until cancelled)'''
+        loop = asyncio.get_running_loop()
+        while True:
+            start = loop.time()
+            await asyncio.sleep(interval)
+            self.lag = max(self.lag, loop.time() - start - interval)
+
+    def record(self, result):
+        '''Adds finished update to the window (and adjusts level if window is full)'''
+        self.completed += 1
+        if (result.successful()):
+            self.rtts.append(result.serverObj.ping)
+        # servers that were offline time out anyway so only online ones tell us something
+        if (result.serverRecord[6] == 1):
+            self.expected += 1
+            if (not result.successful() and self.timedOut(result)):
+                self.timeouts += 1
+        # window is as big as current level (but not too small to judge)
+        if (self.completed >= max(self.level, 20)):
+            self.adjust()
+
+    def timedOut(self, result):
+        return isinstance(result.reason, c.ARKServerError) and isinstance(result.reason.error, base.TimeoutError)
+
+    def healthy(self):
+        if (self.lag > self.maxLoopLag):
+            return False
+        if (self.expected > 0 and self.timeouts / self.expected > self.maxTimeoutRate):
+            return False
+        if (self.rtts.__len__() > 0):
+            median = statistics.median(self.rtts)
+            # baseline slowly goes up so it can follow changes in servers we update
+            if (self.baselineRtt == None or median < self.baselineRtt):
+                self.baselineRtt = median
+            else:
+                self.baselineRtt *= 1.01
+            if (median > self.baselineRtt * self.rttFactor):
+                return False
+        return True
+
+    def adjust(self):
+        if (self.healthy()):
+            self.level = min(self.level + self.increaseStep, self.maximum)
+            # new slots can be taken right away
+            self.wake()
+        else:
+            self.level = max(int(self.level * self.decreaseFactor), self.minimum)
+        self.resetWindow()
+
+
+def percentile(values, part):
+    '''Returns value below which part (0-1) of values are (0 if there are no values)'''
+    if (values.__len__() == 0):
+        return 0.0
+    values = sorted(values)
+    return values[min(values.__len__() - 1, int(values.__len__() * part))]
+
+
+class ActivityTimer():
+    """
+    Measures time when updater was doing something (syncing, updating servers or saving results)
+    Loops are mostly idle because updates are spread over the interval so wall time says little
+    """
+    def __init__(self):
+        self.running = 0 # things running right now
+        self.since = 0.0 # when first of them started
+        self.total = 0.0 # seconds
+
+    def begin(self, count=1):
+        if (self.running == 0):
+            self.since = time.perf_counter()
+        self.running += count
+
+    def end(self, count=1):
+        self.running -= count
+        if (self.running == 0):
+            self.total += time.perf_counter() - self.since
+
+    def pop(self):
+        '''Returns active time since last call'''
+        now = time.perf_counter()
+        total = self.total
+        if (self.running > 0):
+            total += now - self.since
+            self.since = now
+        self.total = 0.0
+        return total
+
+
+class FreshnessTracker():
+    """
+    Measures how old data of servers is
+    * staleness - time between two successful updates of a server (how old data was when it got replaced)
+    * lateness - how late servers were sent to update after they were due
+    * carried - servers that didn't fit into their loop and were moved to the next one
+    """
+    def __init__(self):
+        self.lastSuccess = {} # id -> time of last successful update
+        self.start()
+
+    def start(self):
+        '''Starts new cycle'''
+        self.staleness = []
+        self.lateness = []
+        self.carried = 0
+
+    def dispatched(self, due, now):
+        self.lateness.append(max(0.0, now - due))
+
+    def record(self, result, now):
+        if (not result.successful()):
+            return
+        last = self.lastSuccess.get(result.Id)
+        # first update since start tells nothing
+        if (last != None):
+            self.staleness.append(now - last)
+        self.lastSuccess[result.Id] = now
+
+    def forget(self, ids):
+        '''Keeps only servers with these ids'''
+        self.lastSuccess = {id: last for id, last in self.lastSuccess.items() if id in ids}
+
+    def summary(self, now):
+        '''Returns distributions of current cycle (seconds)'''
+        ages = [now - last for last in self.lastSuccess.values()]
+        return {
+            'staleness': {'p50': percentile(self.staleness, 0.5), 'p90': percentile(self.staleness, 0.9),
+                          'p99': percentile(self.staleness, 0.99), 'max': max(self.staleness, default=0.0)},
+            # age of the data of every server that answered at least once
+            'age': {'p50': percentile(ages, 0.5), 'p90': percentile(ages, 0.9),
+                    'p99': percentile(ages, 0.99), 'max': max(ages, default=0.0)},
+            'lateness': {'p50': percentile(self.lateness, 0.5), 'max': max(self.lateness, default=0.0)},
+            'carried': self.carried,
+        }
+
+
+class ChangeTracker():
+    """
+    Remembers what was written to DB for each server so unchanged objects aren't encoded and written again
+    * server - hash of everything but ping, ping is rewritten only if it moved by more than pingThreshold ms
+    * players - hash of player names, their times grow by themselves so they are rewritten
+      after playersTimeThreshold seconds
+    Servers without changes get only a heartbeat (LastOnline, OfflineTrys, Info, LastUpdated)
+    """
+    def __init__(self, pingThreshold, playersTimeThreshold):
+        self.pingThreshold = pingThreshold
+        self.playersTimeThreshold = playersTimeThreshold
+        self.servers = {} # id -> (hash, ping) of written ServerObj
+        self.players = {} # id -> (hash, time of the write) of written PlayersObj
+        self.skipped = 0 # objects that weren't written in this cycle
+        self.written = 0 # objects that were written in this cycle
+
+    def start(self):
+        '''Starts new cycle'''
+        self.skipped = 0
+        self.written = 0
+
+    def serverChanged(self, id, server):
+        '''Returns hash of the server if it must be written (None if DB already has it)'''
+        fields = hash(tuple((key, tuple(value) if isinstance(value, list) else value)
+                            for key, value in sorted(server.encode().items()) if key != 'ping'))
+        written = self.servers.get(id)
+        if (written != None and written[0] == fields and abs(written[1] - server.ping) <= self.pingThreshold):
+            self.skipped += 1
+            return None
+        self.written += 1
+        return fields
+
+    def playersChanged(self, id, players, now):
+        '''Returns hash of the players if they must be written (None if DB already has them)'''
+        names = hash(tuple(players.names))
+        written = self.players.get(id)
+        if (written != None and written[0] == names and now - written[1] < self.playersTimeThreshold):
+            self.skipped += 1
+            return None
+        self.written += 1
+        return names
+
+    def wrote(self, id, server=None, ping=None, players=None, now=None):
+        if (server != None):
+            self.servers[id] = (server, ping)
+        if (players != None):
+            self.players[id] = (players, now)
+
+    def forget(self, ids):
+        '''Drops what we know about these servers (they were changed by someone else)'''
+        for id in ids:
+            self.servers.pop(id, None)
+            self.players.pop(id, None)
+
+
+# updater loop runs x times per updateFrequency
+# (each loop updates servers due in it's part of the period and watched servers can be updated more often)
+TICKS_PER_INTERVAL = 4
+
+# how long shard worker waits for results of it's process before it sends new servers to it (seconds)
+SHARD_COLLECT_WAIT = 0.2
+
+
+class UpdateScheduler():
+    """
+    Decides which servers are due for an update
+    Keeps a heap of (next update time, server id)
+    * servers that answer are updated every interval seconds
+      (scaled by demand: watched servers more often, others less often)
+      at their own phase (from id) so updates are spread evenly over the interval
+    * servers that don't answer are updated less and less often (up to maxInterval)
+    """
+    def __init__(self, interval, tick, maxInterval, jitter):
+        self.interval = interval # seconds between updates of online server
+        self.tick = tick # popDue returns servers due in next x seconds
+        self.maxInterval = maxInterval # max seconds between updates of offline server
+        self.jitter = jitter # random part of offline interval (0.2 - +-20%)
+        self.heap = [] # (due time, id)
+        self.due = {} # id -> due time (heap entries that don't match are outdated)
+        self.lastUpdate = {} # id -> (time of last update, offline trys)
+        self.factors = {} # id -> interval multiplier picked by demand (1 if not set)
+
+    def sync(self, ids, now):
+        '''Adds new servers (due right away) and forgets deleted ones'''
+        ids = set(ids)
+        for id in ids:
+            if (id not in self.due):
+                self.schedule(id, now + self.phase(id))
+        for id in [id for id in self.due if id not in ids]:
+            # heap entry will be skipped when popped
+            del self.due[id]
+            self.lastUpdate.pop(id, None)
+
+    def phase(self, id):
+        '''Offset of the server inside of interval (same for the same id, spread evenly)'''
+        # Knuth's multiplicative hash so neighbour ids don't get neighbour offsets
+        return (id * 2654435761 % 2 ** 32) / 2 ** 32 * self.interval
+
+    def schedule(self, id, due):
+        self.due[id] = due
+        heapq.heappush(self.heap, (due, id))
+
+    def popDue(self, now):
+        '''Returns (due time, id) of servers that need an update before next tick (sorted by time)'''
+        due = []
+        limit = now + self.tick
+        while (self.heap.__len__() > 0 and self.heap[0][0] < limit):
+            time, id = heapq.heappop(self.heap)
+            # deleted or rescheduled server
+            if (self.due.get(id) != time):
+                continue
+            due.append((time, id))
+        return due
+
+    def intervalFor(self, id, offlineTrys):
+        if (offlineTrys <= 1):
+            # online (or just went down)
+            return self.interval * self.factors.get(id, 1.0)
+        # exponential backoff with jitter so offline servers don't come back all at once
+        interval = min(self.interval * 2 ** min(offlineTrys - 1, 32), self.maxInterval)
+        return interval * random.uniform(1 - self.jitter, 1 + self.jitter)
+
+    def reschedule(self, id, offlineTrys, now):
+        '''Schedules next update of a server after it was updated'''
+        if (id not in self.due):
+            return
+        self.lastUpdate[id] = (now, offlineTrys)
+        interval = self.intervalFor(id, offlineTrys)
+        if (offlineTrys > 1):
+            self.schedule(id, now + interval)
+            return
+        # count from the time it was due (not when it was done) so server keeps it's phase
+        due = self.due[id] + interval
+        # skip slots we missed
+        while (due <= now):
+            due += interval
+        self.schedule(id, due)
+
+    def setDemand(self, consumers, watchedFactor, maxUnwatchedFactor):
+        '''
+        Picks interval multipliers from count of consumers of each server
+        consumers - id -> count of things that use the server (auto messages, notifications, requests)
+        Watched servers get watchedFactor, others get slower interval so that
+        total count of updates stays the same (but not slower than maxUnwatchedFactor)
+        '''
+        total = self.due.__len__()
+        watched = [id for id in self.due if consumers.get(id, 0) > 0]
+        unwatched = total - watched.__len__()
+        if (watched.__len__() == 0 or unwatched == 0):
+            # nobody to take updates from
+            self.factors = {}
+            return
+        # watched / watchedFactor + unwatched / unwatchedFactor = total (updates per interval)
+        # so unwatched servers pay for faster updates of watched ones
+        spare = total - watched.__len__() / watchedFactor
+        if (spare * maxUnwatchedFactor >= unwatched):
+            unwatchedFactor = unwatched / spare
+        else:
+            # too many watched servers: slow unwatched down as much as allowed
+            # and give watched servers what is left
+            unwatchedFactor = maxUnwatchedFactor
+            watchedFactor = watched.__len__() / (total - unwatched / maxUnwatchedFactor)
+        factors = {id: unwatchedFactor for id in self.due}
+        for id in watched:
+            factors[id] = watchedFactor
+        self.factors = factors
+        # servers that became watched shouldn't wait for their old (slow) update time
+        for id in watched:
+            if (id not in self.lastUpdate):
+                continue
+            last, offlineTrys = self.lastUpdate[id]
+            if (offlineTrys > 1):
+                continue
+            due = last + self.intervalFor(id, offlineTrys)
+            if (due < self.due[id]):
+                self.schedule(id, due)
+
+
+# returns the latest of timestamps (or current if there are none)
+def latest(timestamps, current):
+    timestamps = [i for i in timestamps if i != None]
+    if (current != None):
+        timestamps.append(current)
+    return max(timestamps, default=None)
+
+
+# updater writes a server only if nobody else holds a lease for it
+# (so an updater that lost it's lease doesn't overwrite newer data)
+LEASE_CHECK = "(LeaseOwner IS NULL OR LeaseOwner = %s OR LeaseExpires < NOW())"
+
+
+class ServerUpdater():
+    """
+    Queries one server and makes an UpdateResult out of it
+    Used by NeoUpdater and by shard processes (see shard.py)
+    """
+    def __init__(self, cfg):
+        self.cfg = cfg
+
+    # called when update of a server fails with unexpected error
+    def reportError(self, e, serverRecord):
+        traceback.print_exception(type(e), e, e.__traceback__)
+
+    # decides if rules of the server need to be queried on this cycle
+    def rulesNeeded(self, result):
+        # if we have nothing cached
+        if (not hasattr(result.cachedServer, 'PVE')):
+            return True
+        # if server came back online (it could have been reconfigured while it was down)
+        if (result.serverRecord[6] == 0):
+            return True
+        # refresh rules once in a while anyway
+        lastUpdate = result.moreInfo.get('rulesUpdated', 0)
+        return time.time() - lastUpdate >= self.cfg.rulesRefreshInterval
+
+    # decides if players should be queried together with info
+    def playersExpected(self, result):
+        # if server was down there is nothing to compare with
+        if (result.serverRecord[6] == 0):
+            return False
+        # if there were players on the server last time there are likely some now
+        return getattr(result.cachedServer, 'online', 0) > 0
+
+    # checks if info reply shows that rules could have changed
+    def rulesChanged(self, result, server):
+        # new name or version means that server was restarted (maybe with new settings)
+        cached = result.cachedServer
+        return getattr(cached, 'name', None) != server.name or getattr(cached, 'version', None) != server.version
+
+    # function that updates some server
+    async def updateServer(self, serverRecord):
+        Ip = serverRecord[1] # get IP of the server 
+        # decode cached data of the server (result is failed until we hear from the server)
+        result = UpdateResult(False, None, None, serverRecord)
+        serverQuery = c.ServerQuery(Ip) # construct class
+        # pick timeout from previous round trips to the server
+        estimator = query.RTTEstimator(result.moreInfo.get('rtt'),
+                                       self.cfg.minQueryTimeout, self.cfg.maxQueryTimeout)
+        timeouts = {kind: estimator.timeout() for kind in query.KINDS}
+        kinds = [query.INFO]
+        # rules almost never change so most of the time we don't ask for them
+        if (self.rulesNeeded(result)):
+            kinds.append(query.RULES)
+        # ask for players right away only if someone was playing last time
+        # else wait for info to see if there is anyone to ask about
+        if (self.playersExpected(result)):
+            kinds.append(query.PLAYERS)
+        
+        try:
+            # send requests concurrently
+            # raise BaseException() uncomment to make havoc 
+            await serverQuery.AQuery(timeouts, kinds)
+            # what we need to ask for after we got info
+            followUp = []
+            if (serverQuery.online()):
+                # if server was renamed or updated ask for rules too
+                if (query.RULES not in kinds and self.rulesChanged(result, serverQuery.server)):
+                    followUp.append(query.RULES)
+                # if there are players on the server now
+                if (query.PLAYERS not in kinds and serverQuery.server.online > 0):
+                    followUp.append(query.PLAYERS)
+            if (followUp.__len__() > 0):
+                await serverQuery.AQuery(timeouts, followUp)
+        except BaseException as e: # if it isn't our error
+            # something bad happend
+            self.reportError(e, serverRecord)
+            # and go on
+            result.reason = e # return fail and reason
+            return result
+        
+        # if server didn't answer info request
+        if (not serverQuery.online()):
+            result.reason = serverQuery.error() # return fail and reason
+            # wait longer next time in case it was just slow
+            if (isinstance(result.reason.error, base.TimeoutError)):
+                estimator.failure()
+                result.moreInfo['rtt'] = estimator.state()
+            return result
+        
+        # else return success (with a reason if only part of requests answered)
+        result.result = True
+        result.serverObj = serverQuery.server
+        result.playersObj = serverQuery.players
+        result.reason = serverQuery.error()
+        # learn from this round trip
+        estimator.success(serverQuery.info.ping)
+        result.moreInfo['rtt'] = estimator.state()
+        if (query.RULES in serverQuery.answered):
+            # remember when we got rules last time
+            result.moreInfo['rulesUpdated'] = int(time.time())
+        # if we didn't ask for rules or they didn't answer take them from the cache
+        elif (not result.serverObj.copyRules(result.cachedServer)):
+            # if we have nothing cached than the update is failed
+            result.result = False
+            result.serverObj = None
+            result.playersObj = None
+            result.reason = serverQuery.errors.get(query.RULES)
+            return result
+        # if players didn't answer keep the last known list
+        if (query.PLAYERS in serverQuery.errors):
+            result.playersObj = result.cachedPlayers
+        # if we didn't ask for players there is no one on the server
+        elif (query.PLAYERS not in serverQuery.answered):
+            # reuse cached list if it is empty too
+            if (result.cachedPlayers.names.__len__() == 0):
+                result.playersObj = result.cachedPlayers
+        return result
+
+
+class NeoUpdater(commands.Cog, ServerUpdater):
     def __init__(self, bot) -> None:
         print("entered neo updater init")
         self.bot = bot
         self.cfg = config.Config()
         # count of concurrent functions to run
         self.workersCount = self.cfg.workersCount
+        # picks servers that need an update
+        self.scheduler = UpdateScheduler(self.cfg.updateFrequency, self.cfg.updateFrequency / TICKS_PER_INTERVAL,
+                                         self.cfg.maxOfflineInterval, self.cfg.offlineIntervalJitter)
+        # picks count of concurrent updates (starts from workersCount)
+        self.controller = ConcurrencyController(self.workersCount, self.cfg.minWorkersCount, self.cfg.maxWorkersCount,
+                                                self.cfg.maxLoopLag, self.cfg.maxTimeoutRate)
         self.plugins = [] # list of classes which would receive batches of update results 
-        self.servers = None # local cache of all servers from DB. Updated on every iteration
-        self.serversIds = None # list of ids of the servers from local cache for faster searching
+        self.registry = ServerRegistry() # local cache of all servers from DB. Loaded once and synced on every iteration
+        self.syncCursor = None # latest ExternalChange we have seen
+        self.incrementalSync = True # false if DB has no ExternalChange column yet (whole table is loaded every loop)
+        self.guildsCursor = None # latest settings.LastChanged we have seen
+        self.incrementalGuilds = True # false if DB has no settings.LastChanged column yet (whole table is loaded every loop)
+        self.lastSync = {} # what last sync did (for logs)
+        self.requested = {} # server id -> when someone looked at it last time (server info)
+        self.shards = [] # worker processes (if updaterProcesses > 0)
+        self.shardLimits = None # packet rate limits of every worker process
+        self.freshness = FreshnessTracker() # how old data of servers is
+        # what was written to DB (to skip unchanged objects)
+        self.changes = ChangeTracker(self.cfg.pingChangeThreshold, self.cfg.playersTimeThreshold)
+        self.lastCycle = {} # freshness of last cycle (see FreshnessTracker.summary)
+        self.carryOver = [] # (due time, id) of servers that didn't fit into last loop
+        self.deadline = 0 # servers that aren't sent to update before this time go to the next loop
+        self.ticks = 0 # loops since start
+        self.reportDue = False # true on the last loop of every updateFrequency (reports are sent only then)
+        self.busyTime = 0.0 # seconds loops of current report took
+        self.activity = ActivityTimer() # how much of that time updater was doing something
+        self.shardPackets = query.PacketScheduler.mergeStats([]) # packet stats of worker processes since last report
+        self.updatedCount = 0 # servers updated in loops of current report
+        self.demand = {} # server id -> count of auto messages and watch notifications
+        self.demandLoaded = None # when demand was loaded from DB (monotonic)
+        # name of this updater in LeaseOwner column
+        self.instance = self.cfg.updaterInstance if self.cfg.updaterInstance != '' else f'{socket.gethostname()}:{os.getpid()}'
+        self.leased = set() # ids of servers this updater leased (if updaterLeases is on)
+        self.update.change_interval(seconds=self.cfg.updateFrequency / TICKS_PER_INTERVAL)
         self.update.start() # start main loop 
 
     # let's do anything normal __init__ can't do 
     async def init(self): 
         self.httpSession = aiohttp.ClientSession()  # for use in http API's
-        self.sqlPool = await aiomysql.create_pool(host=self.cfg.dbHost, port=3306,  # somehow works see:
-                                                  # https://github.com/aio-libs/aiomysql/issues/574
-                                                  user=self.cfg.dbUser, password=self.cfg.dbPass,
-                                                  db=self.cfg.DB, loop=asyncio.get_running_loop(), minsize=2)
+        # limit rate of A2S packets so we don't flood our socket buffers and the servers
+        query.configure(self.cfg.packetsPerSecond, self.cfg.packetsBurst,
+                        self.cfg.perIpPacketsPerSecond, self.cfg.perIpPacketsBurst)
+        # connection pool is shared with the rest of the bot (see helpers.getPool)
+        self.sqlPool = await getPool()
+        await self.checkSchema()
+        # count of batches that can be written to DB at the same time
+        self.writeSlots = asyncio.Semaphore(self.cfg.maxPendingWrites)
+        # start worker processes if updates are sharded
+        if (self.cfg.updaterProcesses > 0):
+            await self.startShards(self.cfg.updaterProcesses)
         # add debug plugin to list of plugins
         self.plugins.append(DebugPlugin(self))
         # add Battlemetrics plugin
@@ -121,52 +701,241 @@ class NeoUpdater(commands.Cog):
                               # self.destroy will run anything to destroy 
 
 
+    # something bad happend while updating a server
+    def reportError(self, e, serverRecord):
+        asyncio.create_task(self.onError(e))
+        # pls notify me
+        asyncio.create_task(sendToMe(f'Server failed!\nId:{serverRecord[0]} ,Ip:{serverRecord[1]}',self.bot))
+
+    # ~~~~~~~~~~~~~~~~~~~~~
+    #        DEMAND
+    # ~~~~~~~~~~~~~~~~~~~~~
+
+    # remembers that someone looked at a server (used by /server info)
+    def noteRequest(self, serverId):
+        self.requested[serverId] = time.monotonic()
+
+    # counts consumers of each server and lets the scheduler pick intervals
+    async def loadDemand(self, now):
+        # auto messages and notifications don't change often so tables are read once per updateFrequency
+        if (self.demandLoaded == None or now - self.demandLoaded >= self.cfg.updateFrequency):
+            demand = {}
+            # auto messages
+            for serverId, count in await self.makeAsyncRequest('SELECT ServerId, COUNT(*) FROM automessages GROUP BY ServerId'):
+                demand[serverId] = demand.get(serverId, 0) + count
+            # watch notifications
+            for (serversIds,) in await self.makeAsyncRequest('SELECT ServersIds FROM notifications'):
+                try:
+                    ids = json.loads(serversIds)
+                except ValueError:
+                    continue
+                for serverId in ids:
+                    demand[serverId] = demand.get(serverId, 0) + 1
+            self.demand = demand
+            self.demandLoaded = now
+        consumers = dict(self.demand) # server id -> count of consumers
+        # recent requests
+        for serverId, requested in list(self.requested.items()):
+            if (now - requested > self.cfg.demandWindow):
+                del self.requested[serverId]
+                continue
+            consumers[serverId] = consumers.get(serverId, 0) + 1
+        self.scheduler.setDemand(consumers, self.cfg.watchedIntervalFactor, self.cfg.maxUnwatchedIntervalFactor)
+
     # ~~~~~~~~~~~~~~~~~~~~~
     #         MISC
     # ~~~~~~~~~~~~~~~~~~~~~
 
-    # generates array of ids of servers from local cache
-    async def flattenCache(self):
-        # list comprehension is faster
-        return [i[0] for i in self.servers] 
+    # checks that DB has columns added by new_version_changelog.md (older DB still works, just slower)
+    async def checkSchema(self):
+        columns = [i[0] for i in await self.makeAsyncRequest("SHOW COLUMNS FROM servers")]
+        self.incrementalSync = 'ExternalChange' in columns
+        if (not self.incrementalSync):
+            await sendToMe('Table `servers` has no `ExternalChange` column (see new_version_changelog.md)! Updater will load whole table every loop.', self.bot)
+        if (self.cfg.updaterLeases and ('LeaseOwner' not in columns or 'LeaseExpires' not in columns)):
+            await sendToMe('Table `servers` has no `LeaseOwner` and `LeaseExpires` columns (see new_version_changelog.md)! Updater will update all servers without leases.', self.bot)
+            self.cfg.updaterLeases = False
+        if (self.cfg.updaterLeases and (await self.makeAsyncRequest("SHOW TABLES LIKE 'updaters'")).__len__() == 0):
+            await sendToMe('There is no `updaters` table (see new_version_changelog.md)! Updater will update all servers without leases.', self.bot)
+            self.cfg.updaterLeases = False
+        columns = [i[0] for i in await self.makeAsyncRequest("SHOW COLUMNS FROM settings")]
+        self.incrementalGuilds = 'LastChanged' in columns
+        if (not self.incrementalGuilds):
+            await sendToMe('Table `settings` has no `LastChanged` column (see new_version_changelog.md)! Updater will load whole table every loop.', self.bot)
 
-    # searches for an id in local cache (self.servers)
-    async def searchCache(self, id: int):
-        '''
-        Searches for a server record in local cache.
-        If found returns the server record if not returns None
-        '''
+    # loads servers added to guilds that were changed since last sync (whole table first time)
+    async def syncGuilds(self):
+        if (not self.incrementalGuilds):
+            self.registry.loadGuilds(await self.makeAsyncRequest("SELECT GuildId, Type, ServersId FROM settings"))
+            return
+        if (self.guildsCursor == None):
+            settings = await self.makeAsyncRequest("SELECT GuildId, Type, ServersId, LastChanged FROM settings")
+            self.registry.loadGuilds([i[:3] for i in settings])
+        else:
+            # >= so rows changed in the same moment as the last one aren't lost
+            settings = await self.makeAsyncRequest("SELECT GuildId, Type, ServersId, LastChanged FROM settings WHERE LastChanged >= %s", (self.guildsCursor,))
+            self.registry.updateGuilds([i[:3] for i in settings])
+        self.guildsCursor = latest([i[3] for i in settings], self.guildsCursor)
+
+    # loads servers that were added, deleted or changed by someone else since last sync
+    # (whole table is loaded only first time)
+    # with leases only servers we own are kept (commands ask DB about the others, see registry.getRegistry)
+    async def syncServers(self):
+        registry = self.registry
+        await self.syncGuilds()
+        owner, ownerParams = (" WHERE LeaseOwner=%s", (self.instance,)) if self.cfg.updaterLeases else ("", ())
+        # without ExternalChange we can't tell what was changed
+        if (not self.incrementalSync):
+            records = await self.makeAsyncRequest("SELECT * FROM servers" + owner, ownerParams)
+            alive = set(i[0] for i in records)
+            deleted = [id for id in registry.records if id not in alive]
+            for id in deleted:
+                registry.remove(id)
+            added = [i for i in records if i[0] not in registry].__len__()
+            for record in records:
+                registry.put(record)
+            registry.loaded = True
+            self.changes.forget(deleted)
+            self.lastSync = {'loaded': records.__len__(), 'added': added, 'changed': 0, 'deleted': deleted.__len__()}
+            return
+        if (not registry.loaded):
+            for record in await self.makeAsyncRequest("SELECT * FROM servers" + owner, ownerParams):
+                registry.put(record)
+            self.syncCursor = latest([i[10] for i in registry.records.values()], None)
+            registry.loaded = True
+            self.lastSync = {'loaded': registry.__len__(), 'added': 0, 'changed': 0, 'deleted': 0}
+            return
+        # only ids to find deleted and new servers
+        if (self.cfg.updaterLeases):
+            # renewLeases just read them (servers we lost count as deleted)
+            ids = list(self.leased)
+        else:
+            ids = [i[0] for i in await self.makeAsyncRequest("SELECT Id FROM servers")]
+        # rows changed outside of the updater (new rows count as changed)
+        if (self.syncCursor == None):
+            changed = await self.makeAsyncRequest("SELECT * FROM servers" + owner, ownerParams)
+        else:
+            # >= so rows changed in the same moment as the last one aren't lost
+            changed = await self.makeAsyncRequest("SELECT * FROM servers WHERE ExternalChange >= %s" + owner.replace(" WHERE", " AND"),
+                                                  (self.syncCursor,) + ownerParams)
+        changed = {i[0]: i for i in changed}
+        # new rows we didn't get (added between two requests or just leased with what their last owner wrote)
+        missing = [id for id in ids if id not in registry and id not in changed]
+        if (missing.__len__() > 0):
+            statement = "SELECT * FROM servers WHERE Id IN ({})".format(', '.join(['%s'] * missing.__len__()))
+            for record in await self.makeAsyncRequest(statement, missing):
+                changed[record[0]] = record
+        alive = set(ids)
+        deleted = [id for id in registry.records if id not in alive]
+        for id in deleted:
+            registry.remove(id)
+        self.changes.forget(deleted)
+        # DB could have other objects than we wrote
+        self.changes.forget(changed)
+        added = 0
+        for id, record in changed.items():
+            # deleted right after it was changed
+            if (id not in alive):
+                continue
+            if (id not in registry):
+                added += 1
+            registry.put(record)
+        self.syncCursor = latest([i[10] for i in changed.values()], self.syncCursor)
+        self.lastSync = {'loaded': 0, 'added': added, 'changed': changed.__len__() - added, 'deleted': deleted.__len__()}
+
+    # ~~~~~~~~~~~~~~~~~~~~~
+    #        LEASES
+    # ~~~~~~~~~~~~~~~~~~~~~
+
+    # renews our leases, leases free servers and remembers ids of servers we own
+    async def renewLeases(self):
+        await self.heartbeat()
+        # ExternalChange=ExternalChange so leases don't look like changes of the servers
+        await self.makeAsyncRequest("UPDATE servers SET LeaseExpires = NOW() + INTERVAL %s SECOND, ExternalChange=ExternalChange WHERE LeaseOwner=%s",
+                                    (self.cfg.leaseTime, self.instance,))
+        # some leases could have expired and be taken by other updaters
+        owned = [i[0] for i in await self.makeAsyncRequest("SELECT Id FROM servers WHERE LeaseOwner=%s ORDER BY Id", (self.instance,))]
+        share = await self.fairShare()
+        if (owned.__len__() > share):
+            # give excess back so other updaters can take it
+            await self.releaseLeases(owned[share:])
+            owned = owned[:share]
+        else:
+            limit = min(self.cfg.leaseBatchSize, share - owned.__len__())
+            if (limit > 0):
+                owned += await self.claimLeases(limit)
+        self.leased = set(owned)
+        print(f'Leased servers: {self.leased.__len__()} (fair share {share})')
+
+    # lets other updaters know that we are alive (even before we own anything)
+    async def heartbeat(self):
+        await self.makeAsyncRequest("INSERT INTO updaters (Instance, LastSeen) VALUES (%s, NOW()) ON DUPLICATE KEY UPDATE LastSeen = NOW()", (self.instance,))
+        # updaters that stopped (their leases expired too)
+        await self.makeAsyncRequest("DELETE FROM updaters WHERE LastSeen < NOW() - INTERVAL %s SECOND", (self.cfg.leaseTime,))
+
+    # how many servers each live updater should own
+    async def fairShare(self):
+        total = (await self.makeAsyncRequest("SELECT COUNT(*) FROM servers"))[0][0]
+        # live updaters (with us)
+        live = (await self.makeAsyncRequest("SELECT COUNT(*) FROM updaters"))[0][0]
+        share = math.ceil(total / max(1, live))
+        if (self.cfg.maxLeasedServers > 0):
+            share = min(share, self.cfg.maxLeasedServers)
+        return share
+
+    # gives up leases of these servers
+    async def releaseLeases(self, ids):
+        statement = "UPDATE servers SET LeaseOwner=NULL, LeaseExpires=NULL, ExternalChange=ExternalChange WHERE LeaseOwner=%s AND Id IN ({})".format(
+            ', '.join(['%s'] * ids.__len__()))
+        await self.makeAsyncRequest(statement, [self.instance] + ids)
+
+    # leases up to limit servers nobody owns (or whose owner died)
+    async def claimLeases(self, limit):
+        conn = await self.sqlPool.acquire()
         try:
-            # search for that id in flattened local cache 
-            position = self.serversIds.index(id)
-        # if not found
-        except ValueError:
-            # return none
-            return None
-        # return server record from found position
-        return self.servers[position]
-        
-    # performs SQL request using aiomysql pool instead of regular function
+            async with conn.cursor() as cur:
+                await conn.begin()
+                # SKIP LOCKED so updaters claiming at the same time get different servers
+                await cur.execute("SELECT Id FROM servers WHERE LeaseExpires IS NULL OR LeaseExpires < NOW() LIMIT %s FOR UPDATE SKIP LOCKED", (limit,))
+                ids = [i[0] for i in await cur.fetchall()]
+                if (ids.__len__() > 0):
+                    statement = "UPDATE servers SET LeaseOwner=%s, LeaseExpires = NOW() + INTERVAL %s SECOND, ExternalChange=ExternalChange WHERE Id IN ({})".format(
+                        ', '.join(['%s'] * ids.__len__()))
+                    await cur.execute(statement, [self.instance, self.cfg.leaseTime] + ids)
+                await conn.commit()
+        except BaseException as e:
+            await conn.rollback()
+            raise e
+        finally:
+            self.sqlPool.release(conn)
+        return ids
+
+    # performs SQL request using shared pool (regular function uses it too now)
     async def makeAsyncRequest(self, SQL, params=()):
-        # hotfix !
-        #return await makeAsyncRequest(SQL, params)
-        conn = await self.sqlPool.acquire()  # acquire one connecton from the pool
-        async with conn.cursor() as cur:  # with cursor as cur
-            await cur.execute(SQL, params)  # execute SQL with parameters
-            result = await cur.fetchall()  # fetch all results
-            await conn.commit()  # commit changes
-        self.sqlPool.release(conn)  # release current connection to the pool
-        return result  # return result
-
-    async def performance(self,globalStart,globalStop,localStart,chunkTimes):
-        # calculate global time 
-        globalTime = globalStop - globalStart
-        avgChunk = sum(chunkTimes) / len(chunkTimes) 
-        minChunk = min(chunkTimes)
-        maxChunk = max(chunkTimes)
-        await sendToMe(f"New updater took {globalTime:.4f} sec. to update {self.serversIds.__len__()} servers.", self.bot)
-        await sendToMe(f"Min chunk time: {minChunk:.4f}\nAvg chunk time: {avgChunk:.4f}\nMax chunk time: {maxChunk:.4f}",self.bot)
-    
+        return await makeAsyncRequest(SQL, params)
+
+    # sends one report per updateFrequency (stats cover all loops of it)
+    async def performance(self,busyTime,updatedCount):
+        stats = self.lastCycle
+        staleness = stats['staleness']
+        age = stats['age']
+        # how long packets waited for the rate limiter (in this process and in worker processes)
+        packets = query.PacketScheduler.mergeStats([query.getTransport().scheduler.popStats(), self.shardPackets])
+        self.shardPackets = query.PacketScheduler.mergeStats([])
+        # how DB connections were shared (by the whole bot)
+        pool = self.sqlPool.popStats()
+        await sendToMe(f"New updater was busy {self.activity.pop():.2f} of {busyTime:.2f} sec. in {TICKS_PER_INTERVAL} loops to update {updatedCount} of {self.registry.__len__()} servers.\n"
+                       f"Concurrency level: {self.controller.level} ({self.controller.minimum}-{self.controller.maximum})\n"
+                       # how old data of servers is
+                       f"Staleness p50/p90/p99/max: {staleness['p50']:.1f}/{staleness['p90']:.1f}/{staleness['p99']:.1f}/{staleness['max']:.1f} sec.\n"
+                       f"Data age p50/p90/p99/max: {age['p50']:.1f}/{age['p90']:.1f}/{age['p99']:.1f}/{age['max']:.1f} sec.\n"
+                       f"Late by p50/max: {stats['lateness']['p50']:.2f}/{stats['lateness']['max']:.2f} sec.\n"
+                       f"Carried over: {stats['carried']} between loops, {self.carryOver.__len__()} to next loop\n"
+                       f"Objects written: {self.changes.written} ({self.changes.skipped} unchanged)\n"
+                       f"Packets sent: {packets['packets']} ({packets['delayed']} delayed)\nAvg queue delay: {packets['avgDelay'] * 1000:.1f} ms\nMax queue delay: {packets['maxDelay'] * 1000:.1f} ms\n"
+                       f"DB connections: {pool['inUse']} in use of {pool['size']} ({pool['maxSize']} max), {pool['waiting']} waiting ({pool['maxWaiting']} max)\n"
+                       f"Acquires: {pool['acquires']} (avg wait {pool['avgLatency'] * 1000:.1f} ms, max {pool['maxLatency'] * 1000:.1f} ms, {pool['timeouts']} timed out, {pool['reconnects']} reconnected)",self.bot)
+
     # ~~~~~~~~~~~~~~~~~~~~~
     #        PLUGINS
     # ~~~~~~~~~~~~~~~~~~~~~
@@ -221,107 +990,351 @@ class NeoUpdater(commands.Cog):
     #         MAIN
     # ~~~~~~~~~~~~~~~~~~~~~
 
-    # function that updates some server
-    async def updateServer(self, serverRecord):
-        Ip = serverRecord[1] # get IP of the server 
-        server = c.ARKServer(Ip) # construct classes 
-        players = c.PlayersList(Ip)
-        updateServer = server.AGetInfo() # make coroutines
-        updatePlayers = players.AgetPlayersList()
-        
-        try:
-            # run coroutines concurrently
-            # raise BaseException() uncomment to make havoc 
-            results = await asyncio.gather(updateServer, updatePlayers)
-        except c.ARKServerError as e: # if fails
-            return UpdateResult(False, None, None, serverRecord, e) # return fail and reason
-        except BaseException as e: # if it isn't our error
-            # something bad happend
-            asyncio.create_task(self.onError(e))
-            # pls notify me
-            asyncio.create_task(sendToMe(f'Server failed!\nId:{serverRecord[0]} ,Ip:{serverRecord[1]}',self.bot))
-            # and go on
-            return UpdateResult(False, None, None, serverRecord, e) # return fail and reason
-        
-        return UpdateResult(True, results[0], results[1], serverRecord) # else return success
-
-
     async def save(self,results):
+        rows = [] # (Id, LastOnline, OfflineTrys, ServerObj, PlayersObj, Info) (None - object stays as it is)
+        now = time.monotonic()
         # for each server on list
         for result in results:
+            info = json.dumps(result.moreInfo)
             # if update is successful
             if (result.successful()):
-                # make request
-                task = self.makeAsyncRequest("UPDATE servers SET LastOnline=1, OfflineTrys=0, ServerObj=%s, PlayersObj=%s, Info=%s, LastUpdated = CURRENT_TIMESTAMP WHERE Id=%s",
-                (result.serverObj.toJSON(), result.playersObj.toJSON(), json.dumps(result.moreInfo), result.Id,))
-                # run task in background
-                asyncio.create_task(task)
+                serverJSON, playersJSON = None, None
+                serverHash = self.changes.serverChanged(result.Id, result.serverObj)
+                playersHash = self.changes.playersChanged(result.Id, result.playersObj, now)
+                # encode only what changed
+                if (serverHash != None):
+                    serverJSON = result.encoded[0] if result.encoded != None else result.serverObj.toJSON()
+                if (playersHash != None):
+                    playersJSON = result.encoded[1] if result.encoded != None else result.playersObj.toJSON()
+                self.changes.wrote(result.Id, serverHash, result.serverObj.ping, playersHash, now)
+                rows.append((result.Id, 1, 0, serverJSON, playersJSON, info))
+                # keep local cache the same as DB
+                self.registry.store(result.Id, 1, 0,
+                                    serverJSON if serverJSON != None else result.serverRecord[4],
+                                    playersJSON if playersJSON != None else result.serverRecord[5], info)
             else:
-                # make request
-                task = self.makeAsyncRequest("UPDATE servers SET LastOnline=0, OfflineTrys=%s, Info=%s, LastUpdated = CURRENT_TIMESTAMP WHERE Id=%s",
-                                            (result.serverRecord[7] + 1, json.dumps(result.moreInfo), result.Id,))
-                # run task in background
-                asyncio.create_task(task)
-        # after each task generated
-        # run them concurrently
-        # and don't wait for them
-        #asyncio.create_task(asyncio.gather(*tasks))
+                # objects of offline server stay as they are
+                serverJSON, playersJSON = None, None
+                # (unless they are in old format, then they are rewritten in current one)
+                if (c.isOldFormat(result.serverRecord[4])):
+                    serverJSON = result.cachedServer.toJSON()
+                if (c.isOldFormat(result.serverRecord[5])):
+                    playersJSON = result.cachedPlayers.toJSON()
+                rows.append((result.Id, 0, result.serverRecord[7] + 1, serverJSON, playersJSON, info))
+                self.registry.store(result.Id, 0, result.serverRecord[7] + 1,
+                                    serverJSON if serverJSON != None else result.serverRecord[4],
+                                    playersJSON if playersJSON != None else result.serverRecord[5], info)
+        if (rows.__len__() == 0):
+            return
+        # wait if DB is behind (results will pile up and workers will wait too)
+        await self.writeSlots.acquire()
+        # write in background
+        asyncio.create_task(self.write(rows))
 
-    # main updater loop
-    @tasks.loop(seconds=100.0)
-    async def update(self):
-        await sendToMe("Entered updater loop!",self.bot)
-        await self.loopStart() # let the plugins know 
-        globalStart = time.perf_counter() # start performance timer
-        chunksTime = [] # array to hold time each chunk took to process
-        self.servers = await self.makeAsyncRequest("SELECT * FROM servers") # update local cache
-        self.serversIds = await self.flattenCache() # make array with ids only     
-        serversCount = self.servers.__len__() # get how many servers we need to update
-        print(f'Count of servers: {serversCount}')
-        tasks = [] # list of tasks to run concurrently
-        localStart = time.perf_counter() # start performance timer for this chunk
-        # for each server
-        for i in self.serversIds:
-            # search for current server
-            currentServer = await self.searchCache(i)
+    # writes a batch of results with one request (one transaction)
+    async def write(self, rows):
+        # table of new values
+        values = ' UNION ALL '.join(['SELECT %s AS Id, %s AS LastOnline, %s AS OfflineTrys, %s AS ServerObj, %s AS PlayersObj, %s AS Info'] +
+                                    ['SELECT %s, %s, %s, %s, %s, %s'] * (rows.__len__() - 1))
+        # ServerObj and PlayersObj are kept if server is offline or they didn't change (None)
+        # (s.ExternalChange=s.ExternalChange keeps the column from auto updating, it tracks changes made by others)
+        # JOIN (and not INSERT ... ON DUPLICATE KEY UPDATE) so servers deleted in meantime don't come back
+        statement = ("UPDATE servers s JOIN (" + values + ") v ON s.Id = v.Id "
+                     "SET s.LastOnline = v.LastOnline, s.OfflineTrys = v.OfflineTrys, "
+                     "s.ServerObj = IFNULL(v.ServerObj, s.ServerObj), "
+                     "s.PlayersObj = IFNULL(v.PlayersObj, s.PlayersObj), "
+                     "s.Info = v.Info, s.LastUpdated = CURRENT_TIMESTAMP, s.ExternalChange = s.ExternalChange")
+        params = [value for row in rows for value in row]
+        # leases are checked only if they are used
+        if (self.cfg.updaterLeases):
+            statement += " WHERE " + LEASE_CHECK
+            params.append(self.instance)
+        try:
+            await self.makeAsyncRequest(statement, params)
+        except BaseException as e:
+            # we don't know what DB has now
+            self.changes.forget([row[0] for row in rows])
+            await self.onError(e)
+        finally:
+            self.writeSlots.release()
+
+    # puts servers into queues at the time they are due (so load stays flat)
+    # and then puts None for each consumer
+    async def feed(self, due, queues, consumers):
+        for position, (dueTime, id) in enumerate(due):
+            serverRecord = self.registry.get(id)
             # if server not found
-            if (not currentServer):
-                print(f'Skipped server {i}')
-                # skip this server
+            if (serverRecord == None):
+                print(f'Skipped server {id}')
+                continue
+            delay = dueTime - time.monotonic()
+            if (delay > 0):
+                await asyncio.sleep(delay)
+            now = time.monotonic()
+            # loop is out of time: the rest goes first in the next loop
+            if (now >= self.deadline):
+                self.carryOver.extend(due[position:])
+                break
+            self.freshness.dispatched(dueTime, now)
+            # each process gets servers of it's shard
+            queues[self.shardOf(serverRecord, queues.__len__())].put_nowait(serverRecord)
+        for queue in queues:
+            for i in range(consumers):
+                queue.put_nowait(None)
+
+    # picks process for a server by host (not id) so all ports of one host go to one process
+    # and per-ip packet limit of that process is the only one for the host
+    # (crc32 and not hash() so it's the same in every run)
+    def shardOf(self, serverRecord, count):
+        return zlib.crc32(serverRecord[1].rsplit(':', 1)[0].encode()) % count
+
+    # moves servers that were sent to update but weren't started to the next loop
+    def carry(self, serverRecords):
+        for serverRecord in serverRecords:
+            due = self.scheduler.due.get(serverRecord[0])
+            if (due != None):
+                self.carryOver.append((due, serverRecord[0]))
+
+    # takes servers from the queue and updates them one by one until it gets None
+    async def worker(self, pending, finished):
+        while True:
+            serverRecord = await pending.get()
+            if (serverRecord == None):
+                return
+            # wait until controller allows one more update
+            await self.controller.acquire()
+            # waited too long, leave it for the next loop
+            if (time.monotonic() >= self.deadline):
+                await self.controller.release()
+                self.carry([serverRecord])
+                continue
+            self.activity.begin()
+            try:
+                result = await self.updateServer(serverRecord)
+            except BaseException as e: # e.g. broken JSON in the record
+                asyncio.create_task(self.onError(e))
+                # try again later
+                self.scheduler.reschedule(serverRecord[0], serverRecord[7], time.monotonic())
+                # don't let one server stop the worker
+                continue
+            finally:
+                self.activity.end()
+                await self.controller.release()
+            # let controller know how it went
+            self.controller.record(result)
+            self.freshness.record(result, time.monotonic())
+            # plan next update of this server
+            offlineTrys = 0 if result.successful() else result.serverRecord[7] + 1
+            self.scheduler.reschedule(result.Id, offlineTrys, time.monotonic())
+            # pass result to plugins and saving
+            await finished.put(result)
+
+    # starts worker processes (each one updates servers of hosts that shardOf gives it)
+    async def startShards(self, count):
+        import shard # imports this module so it can't be imported at the top
+        # every process gets it's part of packet rate
+        self.shardLimits = (self.cfg.packetsPerSecond / count, max(1, self.cfg.packetsBurst // count),
+                            self.cfg.perIpPacketsPerSecond, self.cfg.perIpPacketsBurst)
+        self.shards = [self.newShard() for i in range(count)]
+        loop = asyncio.get_running_loop()
+        # start processes now (not in the middle of first loop)
+        await asyncio.gather(*[loop.run_in_executor(pool, shard.ready) for pool in self.shards])
+        print(f'Started {count} updater processes')
+
+    # makes one worker process
+    def newShard(self):
+        import shard
+        # forkserver so processes don't get our sockets and running loop
+        context = multiprocessing.get_context('forkserver')
+        context.set_forkserver_preload(['shard'])
+        return concurrent.futures.ProcessPoolExecutor(1, mp_context=context, initializer=shard.init, initargs=(self.shardLimits,))
+
+    # sends servers of one shard to it's process and passes results on as soon as they are done
+    # (several batches are in flight at the same time so one slow server doesn't hold the others)
+    async def shardWorker(self, number, pending, finished):
+        import shard
+        loop = asyncio.get_running_loop()
+        inFlight = {} # id -> record of servers sent to the process and not returned yet
+        maxInFlight = self.cfg.shardBatchesInFlight * self.cfg.updateBatchSize
+        done = False
+        while (not done or inFlight.__len__() > 0):
+            batch = []
+            if (not done):
+                # wait for first server if process has nothing to do, otherwise take only what is due already
+                if (inFlight.__len__() == 0):
+                    batch.append(await pending.get())
+                while (not pending.empty() and batch.__len__() < self.cfg.updateBatchSize and
+                        inFlight.__len__() + batch.__len__() < maxInFlight):
+                    batch.append(pending.get_nowait())
+                if (batch.__len__() > 0 and batch[-1] == None):
+                    done = True
+                    batch.pop()
+            # waited too long, leave them for the next loop
+            if (batch.__len__() > 0 and time.monotonic() >= self.deadline):
+                self.carry(batch)
+                batch = []
+            try:
+                if (batch.__len__() > 0):
+                    # controller's level is shared by all processes
+                    concurrency = max(1, self.controller.level // self.shards.__len__())
+                    await loop.run_in_executor(self.shards[number], shard.submit, batch, concurrency)
+                    inFlight.update((serverRecord[0], serverRecord) for serverRecord in batch)
+                    self.activity.begin(batch.__len__())
+                    batch = []
+                if (inFlight.__len__() == 0):
+                    continue
+                # don't wait long so new servers are sent soon
+                results, errors, packets = await loop.run_in_executor(self.shards[number], shard.collect, SHARD_COLLECT_WAIT)
+            except concurrent.futures.process.BrokenProcessPool as e: # process died
+                asyncio.create_task(self.onError(e))
+                # it took servers in flight with it
+                now = time.monotonic()
+                for serverRecord in batch + list(inFlight.values()):
+                    self.scheduler.reschedule(serverRecord[0], serverRecord[7], now)
+                self.activity.end(inFlight.__len__())
+                inFlight = {}
+                self.shards[number] = self.newShard()
+                continue
+            except BaseException as e: # e.g. records can't be sent
+                asyncio.create_task(self.onError(e))
+                now = time.monotonic()
+                for serverRecord in batch:
+                    self.scheduler.reschedule(serverRecord[0], serverRecord[7], now)
                 continue
-            # make coroutine
-            task = self.updateServer(currentServer)
-            # append new task to task list
-            tasks.append(task)
-            # if enough tasks generated 
-            if (tasks.__len__() >= self.workersCount):
-                # run them concurrently
-                results = await asyncio.gather(*tasks)
+            for error in errors:
+                asyncio.create_task(sendToMe(f'```{error}```', self.bot))
+            self.shardPackets = query.PacketScheduler.mergeStats([self.shardPackets, packets])
+            now = time.monotonic()
+            for id, result in results:
+                serverRecord = inFlight.pop(id, None)
+                # sent before process was replaced
+                if (serverRecord == None):
+                    continue
+                self.activity.end()
+                # update crashed in the process
+                if (result == None):
+                    self.scheduler.reschedule(serverRecord[0], serverRecord[7], now)
+                    continue
+                result = UpdateResult.fromCompact(result, serverRecord)
+                self.controller.record(result)
+                self.freshness.record(result, now)
+                offlineTrys = 0 if result.successful() else serverRecord[7] + 1
+                self.scheduler.reschedule(result.Id, offlineTrys, now)
+                await finished.put(result)
+
+    # groups finished updates into batches (by size or time) and runs plugins and saving on them
+    async def handleResults(self, finished):
+        batch = [] # results waiting to be handled
+        batchStart = 0 # when first result of current batch arrived
+        done = False
+        while (not done):
+            # if we have something in the batch don't hold it for too long
+            timeout = None
+            if (batch.__len__() > 0):
+                timeout = max(0, self.cfg.updateBatchInterval - (time.perf_counter() - batchStart))
+            try:
+                result = await asyncio.wait_for(finished.get(), timeout)
+                # None means that workers are done
+                if (result == None):
+                    done = True
+                else:
+                    if (batch.__len__() == 0):
+                        batchStart = time.perf_counter()
+                    batch.append(result)
+                    # wait for more if batch isn't full yet
+                    if (batch.__len__() < self.cfg.updateBatchSize):
+                        continue
+            except asyncio.TimeoutError:
+                pass
+            if (batch.__len__() == 0):
+                continue
+            self.activity.begin()
+            try:
                 # run plugins 
-                results = await self.runPlugins(results)
-                # empty the list of tasks
-                tasks = []
+                results = await self.runPlugins(batch)
                 # save results in DB
                 await self.save(results)
-                # add chunk time to array
-                chunksTime.append(time.perf_counter() - localStart)
-                # reset timer 
-                localStart = time.perf_counter()
                 print(f'Updated {[i.Id for i in results]}')
-        # if there is some tasks left 
-        if (tasks.__len__() != 0):
-            # run them concurrently
-            results = await asyncio.gather(*tasks)
-            # run plugins
-            results = await self.runPlugins(results)
-            # empty the list of tasks
-            tasks = []
-            # save results in DB
-            await self.save(results)
+            except Exception as e:
+                # keep consuming or workers will wait on full queue forever
+                # batch may be saved only partly so these objects are written next time
+                self.changes.forget([result.Id for result in batch])
+                await self.onError(e)
+            finally:
+                self.activity.end()
+            batch = []
+
+    # main updater loop
+    @tasks.loop(seconds=30.0) # interval is set from config in __init__
+    async def update(self):
+        tick = self.ticks
+        self.ticks += 1
+        # reports cover whole updateFrequency (TICKS_PER_INTERVAL loops) so logs aren't flooded
+        newReport = tick % TICKS_PER_INTERVAL == 0
+        self.reportDue = tick % TICKS_PER_INTERVAL == TICKS_PER_INTERVAL - 1
+        if (newReport):
+            await sendToMe("Entered updater loop!",self.bot)
+            self.freshness.start()
+            self.changes.start()
+            self.busyTime = 0.0
+            self.updatedCount = 0
+        await self.loopStart() # let the plugins know 
+        globalStart = time.perf_counter() # start performance timer
+        self.activity.begin()
+        try:
+            # with several updaters update only servers we leased (registry keeps only them)
+            if (self.cfg.updaterLeases):
+                await self.renewLeases()
+            await self.syncServers() # update local cache
+            print(f'Server list sync: {self.lastSync}')
+            print(f'Count of servers: {self.registry.__len__()}')
+            now = time.monotonic()
+            self.scheduler.sync(self.registry.ids(), now)
+            self.freshness.forget(self.scheduler.due)
+            # update servers people look at more often
+            await self.loadDemand(now)
+        finally:
+            self.activity.end()
+        # servers that didn't fit into last loop go first (if they still exist)
+        carried = [(dueTime, id) for dueTime, id in self.carryOver if self.scheduler.due.get(id) == dueTime]
+        self.carryOver = []
+        self.freshness.carried += carried.__len__()
+        # servers due before next loop
+        due = carried + self.scheduler.popDue(now)
+        print(f'Servers due: {due.__len__()} ({carried.__len__()} from last loop)')
+        # loop should be done before next one starts
+        self.deadline = now + self.scheduler.tick
+        # results of updates (workers wait if plugins or DB can't keep up)
+        finished = asyncio.Queue(self.cfg.updateBatchSize * 4)
+        # handle results while servers are still updating
+        consumer = asyncio.create_task(self.handleResults(finished))
+        # measure event loop lag for the controller
+        self.controller.start()
+        lagMonitor = asyncio.create_task(self.controller.monitorLag())
+        print(f'Concurrency level: {self.controller.level}')
+        if (self.shards.__len__() > 0):
+            # split servers between processes by id
+            shards = [asyncio.Queue() for i in self.shards]
+            await asyncio.gather(self.feed(due, shards, 1),
+                                 *[self.shardWorker(i, shards[i], finished) for i in range(shards.__len__())])
+        else:
+            pending = asyncio.Queue() # servers to update
+            # keep as many updates running as controller allows at all times
+            # (a slow server holds only one worker and not a whole chunk)
+            await asyncio.gather(self.feed(due, [pending], self.controller.maximum),
+                                 *[self.worker(pending, finished) for i in range(self.controller.maximum)])
+        lagMonitor.cancel()
+        # let the consumer know that there will be no more results
+        await finished.put(None)
+        await consumer
         
         globalStop = time.perf_counter()
+        self.busyTime += globalStop - globalStart
+        self.updatedCount += due.__len__() - self.carryOver.__len__()
         # send performance data to me
-        await self.performance(globalStart,globalStop,localStart,chunksTime)
+        if (self.reportDue):
+            self.lastCycle = self.freshness.summary(time.monotonic())
+            await self.performance(self.busyTime, self.updatedCount)
         # let plugins know
         await self.loopEnd()
 
@@ -338,12 +1351,21 @@ class NeoUpdater(commands.Cog):
         type(error), error, error.__traceback__)
         errors_str = ''.join(errors)
         await sendToMe(f'```{errors_str}```',self.bot)
-        await sendToMe(f'Plugins active: {[type(plugin).__name__ for plugin in self.plugins]}\nWorkers count: {self.workersCount}',self.bot,True)
+        await sendToMe(f'Plugins active: {[type(plugin).__name__ for plugin in self.plugins]}\nConcurrency level: {self.controller.level}',self.bot,True)
 
     # will be executed before main loop will be destroyed
     @update.after_loop
     async def destroy(self):
-        self.sqlPool.close()
+        # give our servers to other updaters right away (and not when leases expire)
+        if (self.cfg.updaterLeases):
+            await self.makeAsyncRequest("DELETE FROM updaters WHERE Instance=%s", (self.instance,))
+            await self.makeAsyncRequest("UPDATE servers SET LeaseOwner=NULL, LeaseExpires=NULL, ExternalChange=ExternalChange WHERE LeaseOwner=%s", (self.instance,))
+        for pool in self.shards:
+            pool.shutdown(wait=False)
+        # let other updaters take our servers right away
+        if (self.cfg.updaterLeases):
+            await self.makeAsyncRequest("UPDATE servers SET LeaseOwner=NULL, LeaseExpires=NULL, ExternalChange=ExternalChange WHERE LeaseOwner=%s", (self.instance,))
+        # (DB pool isn't closed, the rest of the bot still uses it)
         await self.httpSession.close()
         print("Destroyed updater loop!")
 